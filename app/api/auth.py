@@ -1,13 +1,18 @@
 from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, ConfigDict
 from ..database import get_db
 from .. import crud, schemas, auth
 from ..config import settings
+from .etag import make_etag, not_modified
 
 router = APIRouter()
 
+# Profile data only changes on edits, so browsers may reuse it briefly
+ME_CACHE_CONTROL = "private, max-age=60"
+
 # Request/Response models for login
 class UserLoginRequest(BaseModel):
     username: str
@@ -19,10 +24,12 @@ class UserLoginResponse(BaseModel):
     user: schemas.User
 
 class TokenVerifyRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+    
     token: str
 
 @router.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     """
     Create a new user account
     
@@ -30,20 +37,20 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
     - **username**: User's username (must be unique)  
     - **password**: User's password (will be hashed)
     """
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
+    # Check both uniqueness constraints in a single round trip
+    existing = await crud.get_users_by_email_or_username(db, email=user.email, username=user.username)
+    if any(row.email == user.email for row in existing):
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    db_user = crud.get_user_by_username(db, username=user.username)
-    if db_user:
+    if any(row.username == user.username for row in existing):
         raise HTTPException(status_code=400, detail="Username already taken")
     
-    return crud.create_user(db=db, user=user)
+    return await crud.create_user(db=db, user=user)
 
 @router.post("/login", response_model=UserLoginResponse)
 async def login(
     login_request: UserLoginRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Authenticate user and return JWT token
@@ -51,7 +58,7 @@ async def login(
     - **username**: User's username or email
     - **password**: User's password
     """
-    user = auth.authenticate_user(db, login_request.username, login_request.password)
+    user = await auth.authenticate_user(db, login_request.username, login_request.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -70,13 +77,29 @@ async def login(
 
 
 @router.get("/me", response_model=schemas.User)
-async def get_current_user_info(current_user: schemas.User = Depends(auth.get_current_active_user)):
+async def get_current_user_info(
+    request: Request,
+    current_user: schemas.User = Depends(auth.get_current_active_user)
+):
     """
     Get current authenticated user information
     
     Requires valid JWT token in Authorization header
     """
-    return current_user
+    etag = make_etag(current_user.id, current_user.updated_at or current_user.created_at)
+    cached = not_modified(request, etag, ME_CACHE_CONTROL)
+    if cached is not None:
+        return cached
+    
+    # current_user is already loaded and checked; serialize it directly
+    return ORJSONResponse({
+        "email": current_user.email,
+        "username": current_user.username,
+        "id": current_user.id,
+        "is_active": current_user.is_active,
+        "created_at": current_user.created_at,
+        "updated_at": current_user.updated_at
+    }, headers={"ETag": etag, "Cache-Control": ME_CACHE_CONTROL})
 
 @router.post("/verify-token")
 async def verify_token_endpoint(token_request: TokenVerifyRequest):
@@ -1,28 +1,38 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, UploadFile, File
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import get_db
 from .. import crud, schemas, auth
-from ..config import settings
-from ..services.pdf_processor import PDFProcessor
-import PyPDF2
-import io
+from .etag import make_etag, not_modified
+from ..config import Settings, get_settings
+from ..services.ingestion import ingestion_service
+from ..services.rag import rag_service
+import asyncio
 import os
-import boto3
+import aiofiles
 
 router = APIRouter()
 
-@router.post("/upload", response_model=schemas.Document)
+# Uploads are copied to disk in fixed-size pieces so memory use stays O(chunk)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# The list changes on upload, delete and ingestion, so clients must revalidate
+DOCUMENTS_CACHE_CONTROL = "private, no-cache"
+
+@router.post("/upload", response_model=schemas.Document, status_code=202)
 async def upload_document(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user: schemas.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    settings: Settings = Depends(get_settings)
 ):
-    # Validate file size (max 10MB)
-    if file.size and file.size > 10 * 1024 * 1024:
+    max_size_mb = settings.MAX_FILE_SIZE // (1024 * 1024)
+    # Validate file size when the client declared it
+    if file.size and file.size > settings.MAX_FILE_SIZE:
         raise HTTPException(
             status_code=413, 
-            detail="File too large. Maximum size is 10MB."
+            detail=f"File too large. Maximum size is {max_size_mb}MB."
         )
     # Validate file type (PDF only)
     file_extension = file.filename.split('.')[-1].lower() if file.filename else ""
@@ -31,60 +41,78 @@ async def upload_document(
             status_code=400,
             detail="File type not allowed. Only PDF files are accepted."
         )
-    # Read file content
-    content = await file.read()
-    # Save to local filesystem
-    os.makedirs(settings.UPLOAD_PATH, exist_ok=True)
+    # Stream the upload to a temporary file (the upload directory is created at
+    # startup), enforcing the size cap as we go
     file_path = os.path.join(settings.UPLOAD_PATH, f"{current_user.id}_{file.filename}")
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
-    # Process PDF and extract chunks
-    try:
-        pdf_processor = PDFProcessor()
-        chunks = pdf_processor.process_pdf(file_path)
-        
-        # Store metadata in database
-        document_data = schemas.DocumentCreate(
-            filename=file.filename,
-            s3_url=file_path
+    tmp_path = f"{file_path}.part"
+    size = 0
+    async with aiofiles.open(tmp_path, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > settings.MAX_FILE_SIZE:
+                break
+            await f.write(chunk)
+    if size > settings.MAX_FILE_SIZE:
+        await asyncio.to_thread(os.remove, tmp_path)
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size is {max_size_mb}MB."
         )
-        document = crud.create_document(db=db, document=document_data, user_id=current_user.id)
-        
-        # Create embeddings for the chunks
-        chunk_texts = [chunk['content'] for chunk in chunks]
-        
-        # Generate embeddings using the embedding service
-        embeddings = crud.batch_get_embeddings(chunk_texts)
-        
-        # Store embeddings in the database
-        crud.store_embeddings(db=db, document_id=document.id, chunks=chunk_texts, embeddings=embeddings)
-        
-        return document
-        
-    except Exception as e:
-        # Clean up file if processing fails
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    # Move into place atomically so a reader never sees a half-written PDF
+    await asyncio.to_thread(os.replace, tmp_path, file_path)
+    
+    # Record the document, then parse and embed it after the response is sent
+    document_data = schemas.DocumentCreate(
+        filename=file.filename,
+        s3_url=file_path
+    )
+    document = await crud.create_document(
+        db=db, document=document_data, user_id=current_user.id, status="processing"
+    )
+    background_tasks.add_task(ingestion_service.process_document, document.id, file_path)
+    
+    return document
 
 @router.get("/", response_model=List[schemas.Document])
 async def list_documents(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     current_user: schemas.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    documents = crud.get_user_documents(db, user_id=current_user.id, skip=skip, limit=limit)
+    # Answer revalidation from a one-row aggregate before loading any documents
+    version = await crud.get_user_documents_version(db, user_id=current_user.id)
+    etag = make_etag(current_user.id, skip, limit, *version)
+    cached = not_modified(request, etag, DOCUMENTS_CACHE_CONTROL)
+    if cached is not None:
+        return cached
+    
+    documents = await crud.get_user_documents(db, user_id=current_user.id, skip=skip, limit=limit)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = DOCUMENTS_CACHE_CONTROL
     return documents
 
+@router.get("/{document_id}/status", response_model=schemas.DocumentStatus)
+async def get_document_status(
+    document_id: int,
+    current_user: schemas.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    document = await crud.get_user_document(db, document_id=document_id, user_id=current_user.id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
 @router.delete("/{document_id}")
 async def delete_document(
     document_id: int,
     current_user: schemas.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    document = crud.delete_document(db, document_id=document_id, user_id=current_user.id)
+    document = await crud.delete_document(db, document_id=document_id, user_id=current_user.id)
     if document is None:
         raise HTTPException(status_code=404, detail="Document not found")
+    rag_service.invalidate_search_cache(current_user.id)
     return {"message": "Document deleted successfully"} 
\ No newline at end of file
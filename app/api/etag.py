@@ -0,0 +1,18 @@
+import hashlib
+from typing import Optional
+from fastapi import Request, Response
+
+def make_etag(*parts) -> str:
+    """Build a quoted ETag from the values that identify a response's content"""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+    return f'"{digest}"'
+
+def not_modified(request: Request, etag: str, cache_control: str) -> Optional[Response]:
+    """Return an empty 304 response when the client already holds this ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from ..database import get_db
 from .. import crud, schemas, auth
@@ -11,7 +12,7 @@ router = APIRouter()
 async def query_documents(
     query_request: schemas.QueryRequest,
     current_user: schemas.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Process a query against the user's documents using RAG
@@ -26,15 +27,14 @@ async def query_documents(
         raise HTTPException(status_code=400, detail=error_message)
     
     # Check if user has any documents
-    user_documents = crud.get_user_documents(db, user_id=current_user.id, limit=1)
-    if not user_documents:
+    if not await crud.user_has_documents(db, user_id=current_user.id):
         raise HTTPException(
             status_code=400, 
             detail="You need to upload at least one document before making queries."
         )
     
     # Process query using RAG service
-    result = rag_service.process_query(
+    result = await rag_service.process_query(
         query=query,
         user_id=current_user.id,
         db=db
@@ -44,11 +44,42 @@ async def query_documents(
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["answer"])
     
-    return schemas.QueryResponse(
-        query=result["query"],
-        answer=result["answer"],
-        sources=result["sources"],
-        context_used=result["context_used"]
+    # The result is built by our own service, so skip re-validating it against
+    # the response model (which stays on the route for the OpenAPI schema)
+    return ORJSONResponse({
+        "query": result["query"],
+        "answer": result["answer"],
+        "sources": result["sources"],
+        "context_used": result["context_used"]
+    })
+
+@router.post("/stream")
+async def stream_query(
+    query_request: schemas.QueryRequest,
+    current_user: schemas.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Process a query like POST /query/, streaming the answer as server-sent events
+    
+    Events: `sources` (query, sources, context_used), unnamed `data` events
+    with `{"delta": ...}` answer text, then `done` or `error`.
+    """
+    query = query_request.query.strip()
+    is_valid, error_message = rag_service.validate_query(query)
+    if not is_valid:
+        raise HTTPException(status_code=400, detail=error_message)
+    
+    if not await crud.user_has_documents(db, user_id=current_user.id):
+        raise HTTPException(
+            status_code=400, 
+            detail="You need to upload at least one document before making queries."
+        )
+    
+    return StreamingResponse(
+        rag_service.stream_query(query=query, user_id=current_user.id, db=db),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 @router.get("/history", response_model=List[schemas.QueryHistoryEntry])
@@ -56,7 +87,7 @@ async def get_query_history(
     skip: int = 0,
     limit: int = 20,
     current_user: schemas.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get the current user's query history
@@ -69,7 +100,7 @@ async def get_query_history(
         limit = 50
     
     # Get user's query history
-    history = crud.get_user_query_history(
+    history = await crud.get_user_query_history(
         db=db,
         user_id=current_user.id,
         skip=skip,
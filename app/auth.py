@@ -1,62 +1,195 @@
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+import bcrypt
+import jwt
+import orjson
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from .config import settings
 from .database import get_db
-from . import crud, schemas
+from . import crud, schemas, models
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_password_hash(password: str) -> str:
-    """Hash a password using bcrypt"""
-    return pwd_context.hash(password)
+# Settings are frozen, so the HMAC key and algorithm can be resolved once
+_SIGNING_KEY = settings.SECRET_KEY.encode()
+_ALGORITHM = settings.ALGORITHM
+_TOKEN_LIFETIME_SECONDS = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+# Tokens are signed from orjson-encoded claims (same compact JSON as PyJWT's own);
+# decoding stays with jwt.decode so PyJWT still validates the claims
+_jws = jwt.PyJWS()
 
-def verify_password(plain: str, hashed: str) -> bool:
-    """Verify a plain password against a hashed password"""
-    return pwd_context.verify(plain, hashed)
+def _b64url(data: bytes) -> bytes:
+    """Unpadded base64url, as used for JWT segments"""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+# For HMAC algorithms the keyed hash state and the header segment never change, so
+# both are built once; each token then costs one copy of the HMAC and one update.
+# Any other algorithm is signed by PyJWS.
+_HMAC_DIGESTS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+_JWT_HEADER_SEGMENT = _b64url(orjson.dumps({"alg": _ALGORITHM, "typ": "JWT"}))
+_hmac_template = (
+    hmac.new(_SIGNING_KEY, digestmod=_HMAC_DIGESTS[_ALGORITHM]) if _ALGORITHM in _HMAC_DIGESTS else None
+)
+
+def _claims_json(claims: Dict[str, Any]) -> bytes:
+    """Compact JSON claims, matching PyJWT's json.dumps output"""
+    payload = orjson.dumps(claims)
+    if payload.isascii():
+        return payload
+    # json.dumps escapes non-ASCII characters where orjson writes UTF-8
+    return json.dumps(claims, separators=(",", ":")).encode()
+
+def _encode_claims(claims: Dict[str, Any]) -> str:
+    """Serialize and sign JWT claims; byte-identical to jwt.encode for the same claims"""
+    if _hmac_template is None:
+        return _jws.encode(_claims_json(claims), _SIGNING_KEY, algorithm=_ALGORITHM)
+    signing_input = _JWT_HEADER_SEGMENT + b"." + _b64url(_claims_json(claims))
+    mac = _hmac_template.copy()
+    mac.update(signing_input)
+    return (signing_input + b"." + _b64url(mac.digest())).decode("ascii")
+
+# Authenticated user cache: token digest -> (expiry timestamp, user), in LRU order.
+# Only touched from the event loop with no awaits in between, so no lock is needed.
+TOKEN_CACHE_TTL_SECONDS = 60
+TOKEN_CACHE_MAX_SIZE = 10_000
+_token_cache: "OrderedDict[bytes, Tuple[float, models.User]]" = OrderedDict()
+
+# Verified token payloads, so repeat checks skip the HMAC and JSON decode. Only
+# successfully decoded tokens are stored; "exp" is re-checked on every hit.
+PAYLOAD_CACHE_TTL_SECONDS = 30
+_payload_cache: TTLCache = TTLCache(maxsize=TOKEN_CACHE_MAX_SIZE, ttl=PAYLOAD_CACHE_TTL_SECONDS)
+
+def _token_key(token: str) -> bytes:
+    """Cache key for a bearer token, so caches never hold usable credentials"""
+    return hashlib.sha256(token.encode()).digest()
+
+def _get_cached_user(token: str) -> Optional[models.User]:
+    """Return the cached user for a token if the entry has not expired"""
+    key = _token_key(token)
+    entry = _token_cache.get(key)
+    if entry is None:
+        return None
+    expiry, user = entry
+    if expiry <= time.time():
+        del _token_cache[key]
+        return None
+    _token_cache.move_to_end(key)
+    return user
+
+def _cache_user(token: str, user: models.User, exp: Optional[float]) -> None:
+    """Cache a user until the token expires or the TTL runs out, evicting LRU entries"""
+    expiry = time.time() + TOKEN_CACHE_TTL_SECONDS
+    if exp is not None:
+        expiry = min(exp, expiry)
+    key = _token_key(token)
+    _token_cache[key] = (expiry, user)
+    _token_cache.move_to_end(key)
+    while len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+        _token_cache.popitem(last=False)
+
+# bcrypt only reads the first 72 bytes of a password; truncate explicitly, as
+# passlib did, so newer bcrypt releases don't reject longer passwords
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+def _hash_password(password: str) -> str:
+    """Salt and hash a password at the configured cost factor (blocking)"""
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode("utf-8")[:BCRYPT_MAX_PASSWORD_BYTES], salt).decode("ascii")
+
+def _check_password(plain: str, hashed: str) -> bool:
+    """Check a password against a bcrypt hash, e.g. one written by passlib (blocking)"""
+    return bcrypt.checkpw(plain.encode("utf-8")[:BCRYPT_MAX_PASSWORD_BYTES], hashed.encode("ascii"))
+
+async def get_password_hash(password: str) -> str:
+    """Hash a password using bcrypt in a worker thread so the event loop stays free"""
+    return await asyncio.to_thread(_hash_password, password)
+
+async def verify_password(plain: str, hashed: str) -> bool:
+    """Verify a plain password against a hashed password in a worker thread"""
+    return await asyncio.to_thread(_check_password, plain, hashed)
 
 def create_access_token(email: str) -> str:
     """Create a JWT access token for the given email"""
-    expires_delta = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode = {"sub": email, "exp": datetime.utcnow() + expires_delta}
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    to_encode = {"sub": email, "exp": int(time.time()) + _TOKEN_LIFETIME_SECONDS}
+    encoded_jwt = _encode_claims(to_encode)
     return encoded_jwt
 
+def _looks_like_jwt(token: str) -> bool:
+    """Cheap structural check: three non-empty dot-separated segments"""
+    return token.count(".") == 2 and all(token.split("."))
+
 def verify_token(token: str) -> Dict[str, Any]:
     """Verify and decode a JWT token, returning the payload"""
+    key = _token_key(token)
+    cached = _payload_cache.get(key)
+    if cached is not None and cached["exp"] > time.time():
+        return dict(cached)
+    
+    # Reject obvious garbage before paying for base64 decoding and the HMAC
+    if not _looks_like_jwt(token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token payload",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return payload
-    except JWTError:
+        payload = jwt.decode(
+            token, _SIGNING_KEY, algorithms=[_ALGORITHM], options={"require": ["exp", "sub"]}
+        )
+    except jwt.MissingRequiredClaimError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token payload",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    except jwt.PyJWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate token",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    _payload_cache[key] = payload
+    return dict(payload)
+
+_dummy_password_hash: Optional[str] = None
 
-def authenticate_user(db: Session, username: str, password: str):
+async def prepare_dummy_password_hash() -> str:
+    """Hash the timing-check password once; called at startup so no login pays for it"""
+    global _dummy_password_hash
+    if _dummy_password_hash is None:
+        _dummy_password_hash = await get_password_hash("dummy-password-for-timing")
+    return _dummy_password_hash
+
+async def _verify_dummy_password(password: str) -> None:
+    """Spend the same bcrypt time as a real check so unknown usernames can't be timed"""
+    await verify_password(password, await prepare_dummy_password_hash())
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
     """Authenticate a user with username and password"""
-    user = crud.get_user_by_username(db, username=username)
+    user = await crud.get_user_by_username(db, username=username)
     if not user:
+        await _verify_dummy_password(password)
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     """FastAPI dependency to get the current authenticated user"""
+    cached_user = _get_cached_user(token)
+    if cached_user is not None:
+        return cached_user
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -71,14 +204,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except HTTPException:
         raise credentials_exception
     
-    # Try to find user by email first, then by username
-    user = crud.get_user_by_email(db, email=email)
-    if user is None:
-        user = crud.get_user_by_username(db, username=email)
+    # The subject may be an email or a username; resolve both in one query
+    user = await crud.get_user_by_email_or_username(db, ident=email)
     
     if user is None:
         raise credentials_exception
     
+    _cache_user(token, user, payload.get("exp"))
     return user
 
 async def get_current_active_user(current_user: schemas.User = Depends(get_current_user)):
@@ -1,69 +1,89 @@
-import os
-from dotenv import load_dotenv
-from typing import List
+from functools import lru_cache
+from typing import Annotated, ClassVar, List
+from pydantic import field_validator
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
-# Load environment variables from .env file
-load_dotenv()
+class Settings(BaseSettings):
+    # Values come from the environment / .env file and are parsed once, at construction
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore", frozen=True)
+
+    # Database Configuration - Force SQLite (not read from the environment)
+    DATABASE_URL: ClassVar[str] = "sqlite:///./rag_system.db"
+
+    # Connection pool sizing (per worker process). Size it as
+    # concurrent_requests_per_worker * avg_concurrent_db_calls_per_request.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE: int = 1800
 
-class Settings:
-    # Database Configuration - Force SQLite
-    DATABASE_URL: str = "sqlite:///./rag_system.db"
-    
     # JWT Configuration
-    SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
-    ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
-    ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
-    
+    SECRET_KEY: str = "your-secret-key-here-change-in-production"
+    ALGORITHM: str = "HS256"
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # bcrypt cost factor (work is 2**rounds); keep 12+ in production, 4 is enough for tests
+    BCRYPT_ROUNDS: int = 12
+
     # OpenAI Configuration
-    OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
-    OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-    EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
-    MAX_TOKENS: int = int(os.getenv("MAX_TOKENS", "500"))
-    TEMPERATURE: float = float(os.getenv("TEMPERATURE", "0.7"))
-    
+    OPENAI_API_KEY: str = ""
+    OPENAI_MODEL: str = "gpt-3.5-turbo"
+    EMBEDDING_MODEL: str = "text-embedding-ada-002"
+    MAX_TOKENS: int = 500
+    TEMPERATURE: float = 0.7
+
     # AWS Configuration (optional for testing)
-    AWS_ACCESS_KEY_ID: str = os.getenv("AWS_ACCESS_KEY_ID", "")
-    AWS_SECRET_ACCESS_KEY: str = os.getenv("AWS_SECRET_ACCESS_KEY", "")
-    AWS_REGION: str = os.getenv("AWS_REGION", "us-east-1")
-    S3_BUCKET_NAME: str = os.getenv("S3_BUCKET_NAME", "")
-    
+    AWS_ACCESS_KEY_ID: str = ""
+    AWS_SECRET_ACCESS_KEY: str = ""
+    AWS_REGION: str = "us-east-1"
+    S3_BUCKET_NAME: str = ""
+
     # File Upload Configuration
-    UPLOAD_PATH: str = os.getenv("UPLOAD_PATH", "./uploads")
-    MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", "10485760"))
-    ALLOWED_EXTENSIONS: List[str] = os.getenv("ALLOWED_EXTENSIONS", "pdf").split(",")
-    
+    UPLOAD_PATH: str = "./uploads"
+    MAX_FILE_SIZE: int = 10485760
+    ALLOWED_EXTENSIONS: Annotated[List[str], NoDecode] = ["pdf"]
+
     # Document Processing Configuration
-    CHUNK_SIZE: int = int(os.getenv("CHUNK_SIZE", "1000"))
-    CHUNK_OVERLAP: int = int(os.getenv("CHUNK_OVERLAP", "200"))
-    
+    CHUNK_SIZE: int = 1000
+    CHUNK_OVERLAP: int = 200
+
     # CORS Configuration
-    CORS_ORIGINS: List[str] = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:8000").split(",")
-    
+    CORS_ORIGINS: Annotated[List[str], NoDecode] = ["http://localhost:3000", "http://localhost:8000"]
+
     # Application Configuration
-    DEBUG: bool = os.getenv("DEBUG", "True").lower() == "true"
-    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
-    HOST: str = os.getenv("HOST", "0.0.0.0")
-    PORT: int = int(os.getenv("PORT", "8000"))
-    
+    DEBUG: bool = True
+    LOG_LEVEL: str = "INFO"
+    HOST: str = "0.0.0.0"
+    PORT: int = 8000
+
+    @field_validator("ALLOWED_EXTENSIONS", "CORS_ORIGINS", mode="before")
+    @classmethod
+    def split_comma_separated(cls, value):
+        """Accept comma-separated strings (as in .env) for list settings"""
+        if isinstance(value, str):
+            return value.split(",")
+        return value
+
     def validate(self) -> List[str]:
         """Validate that all required environment variables are set"""
         missing = []
-        
+
         if not self.SECRET_KEY or self.SECRET_KEY == "your-secret-key-here-change-in-production":
             missing.append("SECRET_KEY")
-        
+
         # OpenAI and AWS are optional for basic testing
         return missing
-    
+
     def get_database_url(self) -> str:
         """Get the database URL - always return SQLite"""
         return self.DATABASE_URL
 
-# Create global settings instance
-settings = Settings()
+    def get_async_database_url(self) -> str:
+        """Get the database URL with the aiosqlite asyncio driver"""
+        return self.get_database_url().replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Build the settings once per process; use as a FastAPI dependency"""
+    return Settings()
 
-# Minimal validation for SQLite
-missing_vars = settings.validate()
-if missing_vars and settings.DEBUG:
-    print(f"⚠️  Warning: Missing environment variables: {', '.join(missing_vars)}")
-    print("Make sure to set these in your .env file before running the application.")
\ No newline at end of file
+# Module-level alias for code that runs at import time (engines, clients)
+settings = get_settings()
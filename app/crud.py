@@ -1,66 +1,145 @@
+from cachetools import TTLCache
+from sqlalchemy import select, or_, exists, func, case, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Optional
-import openai
+from functools import lru_cache
+from typing import Iterator, List, Optional
 import numpy as np
 from . import models, schemas, auth
 from .config import settings
-from .services.embeddings import embedding_service
+from .services.embeddings import embedding_service, get_openai_client
 
 # User CRUD operations
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.User).where(models.User.id == user_id))
+    return result.scalars().first()
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+async def get_user_by_email_or_username(db: AsyncSession, ident: str):
+    """Look a user up by email or username in a single query (both columns are indexed)"""
+    result = await db.execute(
+        select(models.User).where(
+            or_(models.User.email == ident, models.User.username == ident)
+        ).order_by(models.User.email != ident).limit(1)  # an email match wins, as before
+    )
+    return result.scalar_one_or_none()
+
+async def get_users_by_email_or_username(db: AsyncSession, email: str, username: str):
+    """Return (email, username) of every user holding either value, in one query"""
+    result = await db.execute(
+        select(models.User.email, models.User.username).where(
+            or_(models.User.email == email, models.User.username == username)
+        )
+    )
+    return result.all()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = auth.get_password_hash(user.password)
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(select(models.User).offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    hashed_password = await auth.get_password_hash(user.password)
     db_user = models.User(
         email=user.email,
         username=user.username,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 # Document CRUD operations
-def get_document(db: Session, document_id: int):
-    return db.query(models.Document).filter(models.Document.id == document_id).first()
+async def get_document(db: AsyncSession, document_id: int):
+    result = await db.execute(select(models.Document).where(models.Document.id == document_id))
+    return result.scalars().first()
+
+async def get_documents(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(select(models.Document).offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def get_user_documents(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100):
+    result = await db.execute(
+        select(models.Document).where(models.Document.user_id == user_id).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
+
+async def get_user_documents_version(db: AsyncSession, user_id: int):
+    """Summarize a user's documents (count, newest id, last change) without loading rows"""
+    result = await db.execute(
+        select(
+            func.count(models.Document.id),
+            func.max(models.Document.id),
+            func.max(func.coalesce(models.Document.updated_at, models.Document.created_at)),
+            # Timestamps have second resolution; count in-flight ingestions so a
+            # processing -> ready flip within the same second still changes the version
+            func.sum(case((models.Document.status == "processing", 1), else_=0))
+        ).where(models.Document.user_id == user_id)
+    )
+    return tuple(result.one())
+
+# user_id -> True for users known to own a document. Only positive answers are
+# cached so a first upload is visible immediately; event-loop only, no lock needed.
+_user_has_documents_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+
+async def user_has_documents(db: AsyncSession, user_id: int) -> bool:
+    """Check whether a user owns any document with an EXISTS query"""
+    if _user_has_documents_cache.get(user_id):
+        return True
+    result = await db.execute(
+        select(exists().where(models.Document.user_id == user_id))
+    )
+    has_documents = bool(result.scalar())
+    if has_documents:
+        _user_has_documents_cache[user_id] = True
+    return has_documents
 
-def get_documents(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Document).offset(skip).limit(limit).all()
+def invalidate_user_has_documents(user_id: int) -> None:
+    """Forget the cached existence check for a user, e.g. after a delete"""
+    _user_has_documents_cache.pop(user_id, None)
 
-def get_user_documents(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Document).filter(models.Document.user_id == user_id).offset(skip).limit(limit).all()
+async def get_user_document(db: AsyncSession, document_id: int, user_id: int):
+    result = await db.execute(
+        select(models.Document).where(
+            models.Document.id == document_id,
+            models.Document.user_id == user_id
+        )
+    )
+    return result.scalars().first()
 
-def create_document(db: Session, document: schemas.DocumentCreate, user_id: int):
-    db_document = models.Document(**document.dict(), user_id=user_id)
+async def create_document(db: AsyncSession, document: schemas.DocumentCreate, user_id: int,
+                          status: str = "ready"):
+    db_document = models.Document(**document.model_dump(), user_id=user_id, status=status)
     db.add(db_document)
-    db.commit()
-    db.refresh(db_document)
+    await db.commit()
+    await db.refresh(db_document)
     return db_document
 
-def delete_document(db: Session, document_id: int, user_id: int):
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id,
-        models.Document.user_id == user_id
-    ).first()
+async def delete_document(db: AsyncSession, document_id: int, user_id: int):
+    document = await get_user_document(db, document_id=document_id, user_id=user_id)
     if document:
-        db.delete(document)
-        db.commit()
+        # Remove the chunks in one statement instead of loading each one so the
+        # ORM can null out its foreign key
+        await db.execute(
+            delete(models.Embedding).where(models.Embedding.document_id == document.id)
+        )
+        await db.delete(document)
+        await db.commit()
+        invalidate_user_has_documents(user_id)
+        embedding_service.invalidate_search_matrix(user_id)
     return document
 
 # Vector operations using the embedding service
+# These take a sync Session; from async handlers call them via `await db.run_sync(...)`
 def store_embeddings(db: Session, document_id: int, chunks: List[str], 
-                    embeddings: List[List[float]]) -> bool:
+                    embeddings: List[List[float]], commit: bool = True) -> bool:
     """
     Store embeddings for document chunks
     
@@ -69,14 +148,16 @@ def store_embeddings(db: Session, document_id: int, chunks: List[str],
         document_id: ID of the document
         chunks: List of text chunks
         embeddings: List of embedding vectors
+        commit: Commit when done; pass False to leave the transaction to the caller
         
     Returns:
         True if successful, False otherwise
     """
-    return embedding_service.store_embeddings(db, document_id, chunks, embeddings)
+    return embedding_service.store_embeddings(db, document_id, chunks, embeddings, commit)
 
 def search_similar_chunks(db: Session, query_embedding: List[float], 
-                         user_id: Optional[int] = None, limit: int = 5) -> List[dict]:
+                         user_id: Optional[int] = None, limit: int = 5,
+                         min_similarity: Optional[float] = None) -> List[dict]:
     """
     Search for similar chunks using cosine similarity
     
@@ -85,11 +166,20 @@ def search_similar_chunks(db: Session, query_embedding: List[float],
         query_embedding: Query embedding vector
         user_id: Optional user ID to filter by user's documents
         limit: Maximum number of results
+        min_similarity: Optional cosine similarity floor applied inside the search
         
     Returns:
         List of similar chunks with metadata
     """
-    return embedding_service.search_similar_chunks(db, query_embedding, user_id, limit)
+    return embedding_service.search_similar_chunks(db, query_embedding, user_id, limit, min_similarity)
+
+async def search_similar_chunks_async(db: AsyncSession, query_embedding: List[float],
+                                      user_id: Optional[int] = None, limit: int = 5,
+                                      min_similarity: Optional[float] = None) -> List[dict]:
+    """Async form of search_similar_chunks; the scoring runs off the event loop"""
+    return await embedding_service.search_similar_chunks_async(
+        db, query_embedding, user_id, limit, min_similarity
+    )
 
 def get_document_chunks(db: Session, document_id: int) -> List[dict]:
     """
@@ -109,26 +199,63 @@ def get_embedding(text: str) -> List[float]:
     """Get embedding for text using OpenAI API"""
     return embedding_service.generate_embedding(text)
 
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, used as a cache key"""
+    return " ".join(query.lower().split())
+
+@lru_cache(maxsize=4096)
+def _cached_query_embedding(model: str, normalized_query: str) -> np.ndarray:
+    # Kept as read-only float32 arrays (~6 KB each) rather than tuples of Python
+    # floats (~50 KB each), so a full cache stays around 25 MB
+    vector = np.asarray(embedding_service.generate_embedding(normalized_query), dtype=np.float32)
+    vector.setflags(write=False)
+    return vector
+
+def get_query_embedding(query: str) -> List[float]:
+    """Get embedding for a user query; repeated (normalized) queries skip the OpenAI API"""
+    # The model is part of the key: the same text embeds differently per model
+    return _cached_query_embedding(embedding_service.model, normalize_query(query)).tolist()
+
 def batch_get_embeddings(texts: List[str]) -> List[List[float]]:
     """Get embeddings for multiple texts in batches"""
     return embedding_service.batch_generate_embeddings(texts)
 
+def _answer_messages(query: str, context: str) -> List[dict]:
+    return [
+        {"role": "system", "content": "You are a helpful assistant that answers questions based on the provided context. Only use information from the context to answer questions."},
+        {"role": "user", "content": f"Context: {context}\n\nQuestion: {query}"}
+    ]
+
 def generate_answer(query: str, context: str) -> str:
     """Generate answer using OpenAI API"""
-    client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+    client = get_openai_client()
     response = client.chat.completions.create(
         model=settings.OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that answers questions based on the provided context. Only use information from the context to answer questions."},
-            {"role": "user", "content": f"Context: {context}\n\nQuestion: {query}"}
-        ],
+        messages=_answer_messages(query, context),
         max_tokens=settings.MAX_TOKENS,
         temperature=settings.TEMPERATURE
     )
     return response.choices[0].message.content
 
+def stream_answer(query: str, context: str) -> Iterator[str]:
+    """Generate answer using OpenAI API, yielding text deltas as they arrive"""
+    client = get_openai_client()
+    stream = client.chat.completions.create(
+        model=settings.OPENAI_MODEL,
+        messages=_answer_messages(query, context),
+        max_tokens=settings.MAX_TOKENS,
+        temperature=settings.TEMPERATURE,
+        stream=True
+    )
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+
 # Query History CRUD operations
-def create_query_history(db: Session, user_id: int, query: str, answer: str, sources_count: int):
+async def create_query_history(db: AsyncSession, user_id: int, query: str, answer: str, sources_count: int):
     """Create a new query history entry"""
     db_query = models.QueryHistory(
         user_id=user_id,
@@ -137,12 +264,15 @@ def create_query_history(db: Session, user_id: int, query: str, answer: str, sou
         sources_count=sources_count
     )
     db.add(db_query)
-    db.commit()
-    db.refresh(db_query)
+    await db.commit()
+    await db.refresh(db_query)
     return db_query
 
-def get_user_query_history(db: Session, user_id: int, skip: int = 0, limit: int = 20):
+async def get_user_query_history(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 20):
     """Get query history for a user"""
-    return db.query(models.QueryHistory).filter(
-        models.QueryHistory.user_id == user_id
-    ).order_by(models.QueryHistory.created_at.desc()).offset(skip).limit(limit).all()
\ No newline at end of file
+    result = await db.execute(
+        select(models.QueryHistory).where(
+            models.QueryHistory.user_id == user_id
+        ).order_by(models.QueryHistory.created_at.desc()).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
\ No newline at end of file
@@ -1,19 +1,61 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from .api import auth, documents, query
-from .database import engine
+from sqlalchemy import inspect, text
+from .database import engine, async_engine
 from . import models
 from .config import settings
+from .services.embeddings import get_openai_client, close_openai_client
+from .services.rag import get_tokenizer
+from .auth import prepare_dummy_password_hash
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
+# create_all never alters existing tables; add columns introduced since to older databases
+if "status" not in {column["name"] for column in inspect(engine).get_columns("documents")}:
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE documents ADD COLUMN status VARCHAR DEFAULT 'ready'"))
+# create_all only indexes tables it creates; add indexes introduced since to existing ones
+for table in models.Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Minimal validation for SQLite
+    missing_vars = settings.validate()
+    if missing_vars and settings.DEBUG:
+        print(f"⚠️  Warning: Missing environment variables: {', '.join(missing_vars)}")
+        print("Make sure to set these in your .env file before running the application.")
+    
+    os.makedirs(settings.UPLOAD_PATH, exist_ok=True)
+    
+    # Warm up shared clients so the first requests don't pay for setup
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+    await prepare_dummy_password_hash()
+    if settings.OPENAI_API_KEY:
+        get_openai_client()
+    # tiktoken fetches the encoding over the network the first time; start that
+    # now, in the background, so startup doesn't wait on it
+    get_tokenizer()
+    
+    yield
+    
+    # Close pooled database and HTTP connections on shutdown
+    await async_engine.dispose()
+    close_openai_client()
 
 app = FastAPI(
     title="RAG System API",
     description="A Retrieval-Augmented Generation system with document management and query capabilities",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware with configurable origins
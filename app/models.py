@@ -1,8 +1,29 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, JSON
+import json
+import numpy as np
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, LargeBinary, Index
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
 
+class Float32Vector(TypeDecorator):
+    """Embedding stored as raw little-endian float32 bytes, read back as a NumPy array"""
+    impl = LargeBinary
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return np.asarray(value, dtype="<f4").tobytes()
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        # Rows written before the switch from JSON hold a JSON array as text
+        if isinstance(value, str):
+            return np.asarray(json.loads(value), dtype=np.float32)
+        return np.frombuffer(value, dtype="<f4")
+
 class User(Base):
     __tablename__ = "users"
     
@@ -24,11 +45,19 @@ class Document(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     filename = Column(String, index=True)
     s3_url = Column(String)
+    # Ingestion state: "processing" until chunks are embedded, then "ready" or "failed"
+    status = Column(String, default="ready")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     owner = relationship("User", back_populates="documents")
-    embeddings = relationship("Embedding", back_populates="document")
+    
+    __table_args__ = (
+        # crud.get_user_documents / user_has_documents filter by owner
+        Index("ix_documents_user_id", "user_id"),
+    )
+    # Chunks are deleted in bulk by crud.delete_document; never load them just to delete
+    embeddings = relationship("Embedding", back_populates="document", passive_deletes=True)
 
 class Embedding(Base):
     __tablename__ = "embeddings"
@@ -36,12 +65,27 @@ class Embedding(Base):
     id = Column(Integer, primary_key=True, index=True)
     document_id = Column(Integer, ForeignKey("documents.id"))
     chunk_text = Column(Text)
-    # Store embedding as JSON array for SQLite compatibility
-    embedding = Column(JSON)  # Will store as JSON array instead of pgvector
+    # float32 bytes (6 KB per vector, decoded without parsing)
+    embedding = Column(Float32Vector)
     chunk_index = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     document = relationship("Document", back_populates="embeddings")
+    
+    __table_args__ = (
+        # Chunks are looked up, replaced and deleted per document
+        Index("ix_embeddings_document_id", "document_id"),
+    )
+
+class EmbeddingCache(Base):
+    """Embeddings by chunk content, so re-uploaded text is not sent to the API again"""
+    __tablename__ = "embedding_cache"
+    
+    # SHA-256 of the chunk text; vectors are kept as returned by the model
+    content_hash = Column(LargeBinary(32), primary_key=True)
+    model = Column(String, primary_key=True)
+    embedding = Column(Float32Vector)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class QueryHistory(Base):
     __tablename__ = "query_history"
@@ -53,4 +97,9 @@ class QueryHistory(Base):
     sources_count = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
-    user = relationship("User", back_populates="query_history")
\ No newline at end of file
+    user = relationship("User", back_populates="query_history")
+    
+    __table_args__ = (
+        # History is read per user, newest first; the index serves both the filter and the order
+        Index("ix_query_history_user_created", "user_id", "created_at"),
+    )
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr
 from typing import Optional, List
 from datetime import datetime
 
@@ -16,8 +16,7 @@ class User(UserBase):
     created_at: datetime
     updated_at: Optional[datetime] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Login schemas
@@ -42,8 +41,7 @@ class UserResponse(BaseModel):
     is_active: bool
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Document schemas
 class DocumentBase(BaseModel):
@@ -56,11 +54,18 @@ class DocumentCreate(DocumentBase):
 class Document(DocumentBase):
     id: int
     user_id: int
+    status: str = "ready"
     created_at: datetime
     updated_at: Optional[datetime] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+class DocumentStatus(BaseModel):
+    id: int
+    filename: str
+    status: str
+    
+    model_config = ConfigDict(from_attributes=True)
 
 # Embedding schemas
 class EmbeddingBase(BaseModel):
@@ -72,8 +77,7 @@ class Embedding(EmbeddingBase):
     document_id: int
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Query schemas
 class QueryRequest(BaseModel):
@@ -94,5 +98,4 @@ class QueryHistoryEntry(BaseModel):
     sources_count: int
     created_at: datetime
     
-    class Config:
-        from_attributes = True
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
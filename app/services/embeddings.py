@@ -1,31 +1,97 @@
+import asyncio
 import time
+import random
+import hashlib
 import logging
-from typing import List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional, Tuple
+from cachetools import LRUCache
 from openai import OpenAI
 from openai import RateLimitError
 import numpy as np
+from sqlalchemy import LargeBinary, insert, type_coerce
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from ..config import settings
-from ..models import Embedding, Document
-from ..database import get_db
+from ..models import Embedding, EmbeddingCache, Document, Float32Vector
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_openai_client: Optional[OpenAI] = None
+
+def get_openai_client() -> OpenAI:
+    """Process-wide OpenAI client, shared by embeddings and chat so they reuse one connection pool"""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    return _openai_client
+
+def close_openai_client() -> None:
+    """Close the shared client's HTTP connections (on application shutdown)"""
+    global _openai_client
+    if _openai_client is not None:
+        _openai_client.close()
+        _openai_client = None
+
+# Longest server-requested rate-limit wait we honor before retrying
+MAX_RETRY_AFTER_SECONDS = 60.0
+
+def _rate_limit_delay(error: RateLimitError, attempt: int) -> float:
+    """Seconds to wait before retrying: the server's Retry-After if sent, else exponential backoff"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    delay = None
+    if headers is not None:
+        try:
+            if headers.get("retry-after-ms") is not None:
+                delay = float(headers.get("retry-after-ms")) / 1000
+            elif headers.get("retry-after") is not None:
+                delay = float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            # HTTP-date or malformed value
+            delay = None
+    if delay is None or delay < 0:
+        delay = 2 ** attempt
+    # Jitter so parallel batches don't retry in lockstep at the window boundary
+    return min(delay, MAX_RETRY_AFTER_SECONDS) + random.uniform(0, 0.1)
+
+# Stored embeddings are unit-length within this tolerance (float32 rounding)
+UNIT_NORM_TOLERANCE = 1e-3
+
+# Embedding cache lookups are split so the IN list stays under SQLite's bound-parameter limit
+CACHE_LOOKUP_PAGE_SIZE = 500
+
 class EmbeddingService:
     def __init__(self):
+        # Optional override (e.g. a stub in tests); otherwise the shared module client is used
         self.client = None
         self.model = settings.EMBEDDING_MODEL
-        self.batch_size = 100
+        # The API accepts up to 2048 inputs per request; batches are normally
+        # closed by the token budget first, so each call carries as much as it can
+        self.batch_size = 2048
+        # Stay well under the API's ~300k tokens-per-request limit
+        self.max_batch_tokens = 250_000
+        self.max_concurrent_batches = 8
         self.max_retries = 3
+        # user_id -> (row ids, L2-normalized float32 matrix) for the in-process
+        # similarity scan. The generation counter is bumped on every invalidation
+        # so a matrix built from pre-commit data is never stored.
+        self._matrix_cache: LRUCache = LRUCache(maxsize=32)
+        self._matrix_generation = 0
+        self._matrix_lock = threading.Lock()
     
     def _get_client(self):
-        """Lazy initialization of OpenAI client"""
-        if self.client is None:
-            self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        return self.client
+        """Return the override client or the shared OpenAI client"""
+        # Resolved on every call rather than copied onto the instance, so a client
+        # closed at shutdown is never reused after the app starts again
+        if self.client is not None:
+            return self.client
+        return get_openai_client()
     
     def generate_embedding(self, text: str) -> List[float]:
         """
@@ -50,8 +116,8 @@ class EmbeddingService:
                 
             except RateLimitError as e:
                 if attempt < self.max_retries - 1:
-                    wait_time = 2 ** attempt
-                    logger.warning(f"Rate limit hit, waiting {wait_time} seconds...")
+                    wait_time = _rate_limit_delay(e, attempt)
+                    logger.warning(f"Rate limit hit, waiting {wait_time:.2f} seconds...")
                     time.sleep(wait_time)
                 else:
                     logger.error(f"Rate limit exceeded after {self.max_retries} attempts")
@@ -60,53 +126,151 @@ class EmbeddingService:
                 logger.error(f"Error generating embedding: {str(e)}")
                 raise e
     
-    def batch_generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+    @staticmethod
+    def _unit_vector(embedding: List[float]) -> np.ndarray:
+        """L2-normalize an embedding so cosine similarity is a plain dot product"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """Conservative token estimate (~3 characters per token for English text)"""
+        return len(text) // 3 + 1
+    
+    def _pack_batches(self, texts: List[str]) -> List[List[str]]:
+        """Greedily group texts into batches capped by input count and estimated tokens"""
+        batches = []
+        batch: List[str] = []
+        batch_tokens = 0
+        for text in texts:
+            tokens = self._estimate_tokens(text)
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def _embed_batch(self, batch: List[str], stagger: bool = False) -> List[List[float]]:
+        """Embed one batch with the rate-limit retry policy"""
+        if stagger:
+            # Spread out concurrent submissions so they don't hit the rate limiter together
+            time.sleep(random.uniform(0, 0.1))
+        for attempt in range(self.max_retries):
+            try:
+                response = self._get_client().embeddings.create(
+                    input=batch,
+                    model=self.model
+                )
+                return [data.embedding for data in response.data]
+                
+            except RateLimitError as e:
+                if attempt < self.max_retries - 1:
+                    wait_time = _rate_limit_delay(e, attempt)
+                    logger.warning(f"Rate limit hit in batch, waiting {wait_time:.2f} seconds...")
+                    time.sleep(wait_time)
+                else:
+                    logger.error(f"Rate limit exceeded for batch after {self.max_retries} attempts")
+                    raise e
+            except Exception as e:
+                logger.error(f"Error generating batch embeddings: {str(e)}")
+                raise e
+    
+    def batch_generate_embeddings(self, texts: List[str],
+                                  db: Optional[Session] = None) -> List[List[float]]:
         """
         Generate embeddings for multiple texts in batches
         
+        Batches are sent concurrently (up to max_concurrent_batches at a time)
+        on the shared client; results keep the order of the input texts.
+        
         Args:
             texts: List of texts to embed
+            db: Optional database session; when given, texts already in the
+                embedding cache are not sent to the API and new vectors are
+                added to the cache (committed with the caller's transaction)
             
         Returns:
             List of embedding vectors
         """
         if not texts:
             return []
+        if db is None:
+            # Repeated texts (headers, footers) are embedded once and shared
+            unique_texts = list(dict.fromkeys(texts))
+            if len(unique_texts) == len(texts):
+                return self._embed_texts(texts)
+            embeddings_by_text = dict(zip(unique_texts, self._embed_texts(unique_texts)))
+            return [embeddings_by_text[text] for text in texts]
         
-        all_embeddings = []
-        
-        # Process in batches
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i:i + self.batch_size]
-            logger.info(f"Processing batch {i//self.batch_size + 1}, size: {len(batch)}")
-            
-            for attempt in range(self.max_retries):
-                try:
-                    response = self._get_client().embeddings.create(
-                        input=batch,
-                        model=self.model
-                    )
-                    
-                    batch_embeddings = [data.embedding for data in response.data]
-                    all_embeddings.extend(batch_embeddings)
-                    break
-                    
-                except RateLimitError as e:
-                    if attempt < self.max_retries - 1:
-                        wait_time = 2 ** attempt
-                        logger.warning(f"Rate limit hit in batch, waiting {wait_time} seconds...")
-                        time.sleep(wait_time)
-                    else:
-                        logger.error(f"Rate limit exceeded for batch after {self.max_retries} attempts")
-                        raise e
-                except Exception as e:
-                    logger.error(f"Error generating batch embeddings: {str(e)}")
-                    raise e
+        hashes = [self._content_hash(text) for text in texts]
+        embeddings_by_hash = self._get_cached_embeddings(db, set(hashes))
+        
+        # Embed each distinct uncached text once, even if it repeats in the document
+        missing = {}
+        for content_hash, text in zip(hashes, texts):
+            if content_hash not in embeddings_by_hash:
+                missing.setdefault(content_hash, text)
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} of {len(texts)} texts reused")
+        
+        if missing:
+            new_embeddings = dict(zip(missing, self._embed_texts(list(missing.values()))))
+            self._cache_embeddings(db, new_embeddings)
+            embeddings_by_hash.update(new_embeddings)
+        
+        return [embeddings_by_hash[content_hash] for content_hash in hashes]
+    
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts through the API in packed, concurrent batches"""
+        batches = self._pack_batches(texts)
+        logger.info(f"Embedding {len(texts)} texts in {len(batches)} batches")
+        
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        
+        # Pre-sized output filled by each batch's absolute offset
+        all_embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        workers = min(self.max_concurrent_batches, len(batches))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            embed_staggered = partial(self._embed_batch, stagger=True)
+            offset = 0
+            for batch, batch_embeddings in zip(batches, executor.map(embed_staggered, batches)):
+                all_embeddings[offset:offset + len(batch)] = batch_embeddings
+                offset += len(batch)
         
         return all_embeddings
     
+    @staticmethod
+    def _content_hash(text: str) -> bytes:
+        """Embedding cache key for a text (combined with the model name)"""
+        return hashlib.sha256(text.encode("utf-8")).digest()
+    
+    def _get_cached_embeddings(self, db: Session, hashes: set) -> dict:
+        """Cached embeddings of this model for the given content hashes"""
+        keys = list(hashes)
+        cached = {}
+        for start in range(0, len(keys), CACHE_LOOKUP_PAGE_SIZE):
+            rows = db.query(EmbeddingCache.content_hash, EmbeddingCache.embedding).filter(
+                EmbeddingCache.model == self.model,
+                EmbeddingCache.content_hash.in_(keys[start:start + CACHE_LOOKUP_PAGE_SIZE])
+            ).all()
+            cached.update((row.content_hash, row.embedding.tolist()) for row in rows)
+        return cached
+    
+    def _cache_embeddings(self, db: Session, embeddings_by_hash: dict) -> None:
+        """Add new embeddings to the cache, skipping keys another ingestion stored first"""
+        # INSERT ... ON CONFLICT DO NOTHING, for rows written by concurrent ingestions
+        stmt = sqlite_insert(EmbeddingCache).on_conflict_do_nothing()
+        db.execute(stmt, [
+            {"content_hash": content_hash, "model": self.model, "embedding": embedding}
+            for content_hash, embedding in embeddings_by_hash.items()
+        ])
+    
     def store_embeddings(self, db: Session, document_id: int, chunks: List[str], 
-                        embeddings: List[List[float]]) -> bool:
+                        embeddings: List[List[float]], commit: bool = True) -> bool:
         """
         Store embeddings in the database
         
@@ -115,6 +279,7 @@ class EmbeddingService:
             document_id: ID of the document
             chunks: List of text chunks
             embeddings: List of embedding vectors
+            commit: Commit when done; pass False to leave the transaction to the caller
             
         Returns:
             True if successful, False otherwise
@@ -126,21 +291,29 @@ class EmbeddingService:
                 logger.error(f"Document {document_id} not found")
                 return False
             
-            # Clear existing embeddings for this document
-            db.query(Embedding).filter(Embedding.document_id == document_id).delete()
+            # Clear existing embeddings for this document (one bulk DELETE; nothing
+            # in the session needs syncing since chunks are never loaded as objects here)
+            db.query(Embedding).filter(Embedding.document_id == document_id).delete(
+                synchronize_session=False
+            )
             
-            # Store new embeddings
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                db_embedding = Embedding(
-                    document_id=document_id,
-                    chunk_text=chunk,
-                    embedding=embedding,  # Store as JSON array
-                    chunk_index=i
-                )
-                db.add(db_embedding)
+            # Store new embeddings with one executemany INSERT instead of per-row ORM adds
+            rows = [
+                {
+                    "document_id": document_id,
+                    "chunk_text": chunk,
+                    "embedding": self._unit_vector(embedding),  # Encoded to float32 bytes by the column type
+                    "chunk_index": i
+                }
+                for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+            ]
+            if rows:
+                db.execute(insert(Embedding), rows)
             
-            db.commit()
-            logger.info(f"Stored {len(embeddings)} embeddings for document {document_id}")
+            if commit:
+                db.commit()
+                self.invalidate_search_matrix(document.user_id)
+            logger.info(f"Stored {len(rows)} embeddings for document {document_id}")
             return True
             
         except Exception as e:
@@ -149,7 +322,8 @@ class EmbeddingService:
             return False
     
     def search_similar_chunks(self, db: Session, query_embedding: List[float], 
-                            user_id: Optional[int] = None, limit: int = 5) -> List[dict]:
+                            user_id: Optional[int] = None, limit: int = 5,
+                            min_similarity: Optional[float] = None) -> List[dict]:
         """
         Search for similar chunks using cosine similarity
         
@@ -158,60 +332,190 @@ class EmbeddingService:
             query_embedding: Query embedding vector
             user_id: Optional user ID to filter by user's documents
             limit: Maximum number of results
+            min_similarity: Optional cosine similarity floor; weaker chunks are not returned
             
         Returns:
             List of similar chunks with metadata
         """
         try:
-            # Get all embeddings
-            query = db.query(Embedding)
+            if limit <= 0:
+                return []
             
-            # Filter by user if specified
-            if user_id:
-                query = query.join(Document).filter(Document.user_id == user_id)
+            search_matrix = self._get_search_matrix(db, user_id)
+            if search_matrix is None:
+                return []
+            top_ids, scores = self._rank_search_matrix(*search_matrix, query_embedding, limit, min_similarity)
+            if not top_ids:
+                return []
+            return self._hydrate_search_results(db, top_ids, scores)
             
-            embeddings = query.all()
+        except Exception as e:
+            logger.error(f"Error searching similar chunks: {str(e)}")
+            return []
+    
+    async def search_similar_chunks_async(self, db: AsyncSession, query_embedding: List[float],
+                                          user_id: Optional[int] = None, limit: int = 5,
+                                          min_similarity: Optional[float] = None) -> List[dict]:
+        """
+        Search for similar chunks from async code without blocking the event loop
+        
+        Same results as search_similar_chunks. Only the row queries go through
+        the session (run_sync executes on the event-loop thread); building the
+        matrix and scoring run in a worker thread.
+        
+        Args:
+            db: Async database session
+            query_embedding: Query embedding vector
+            user_id: Optional user ID to filter by user's documents
+            limit: Maximum number of results
+            min_similarity: Optional cosine similarity floor; weaker chunks are not returned
             
-            if not embeddings:
+        Returns:
+            List of similar chunks with metadata
+        """
+        try:
+            if limit <= 0:
                 return []
             
-            # Calculate cosine similarities
-            similarities = []
-            query_vector = np.array(query_embedding)
-            
-            for emb in embeddings:
-                if emb.embedding:  # Ensure embedding exists
-                    doc_vector = np.array(emb.embedding)
-                    # Cosine similarity
-                    similarity = np.dot(query_vector, doc_vector) / (
-                        np.linalg.norm(query_vector) * np.linalg.norm(doc_vector)
-                    )
-                    similarities.append({
-                        'embedding': emb,
-                        'similarity': similarity
-                    })
-            
-            # Sort by similarity (descending) and return top results
-            similarities.sort(key=lambda x: x['similarity'], reverse=True)
-            
-            results = []
-            for item in similarities[:limit]:
-                emb = item['embedding']
-                results.append({
-                    'id': emb.id,
-                    'document_id': emb.document_id,
-                    'chunk_text': emb.chunk_text,
-                    'chunk_index': emb.chunk_index,
-                    'similarity': item['similarity'],
-                    'document_filename': emb.document.filename if emb.document else None
-                })
+            search_matrix, generation = self._cached_search_matrix(user_id)
+            if search_matrix is None:
+                ids, blobs = await db.run_sync(self._load_search_rows, user_id)
+                search_matrix = await asyncio.to_thread(self._build_search_matrix, ids, blobs)
+                if search_matrix is None:
+                    return []
+                self._store_search_matrix(user_id, search_matrix, generation)
             
-            return results
+            top_ids, scores = await asyncio.to_thread(
+                self._rank_search_matrix, *search_matrix, query_embedding, limit, min_similarity
+            )
+            if not top_ids:
+                return []
+            return await db.run_sync(self._hydrate_search_results, top_ids, scores)
             
         except Exception as e:
             logger.error(f"Error searching similar chunks: {str(e)}")
             return []
     
+    @staticmethod
+    def _rank_search_matrix(ids: np.ndarray, matrix: np.ndarray, query_embedding: List[float],
+                            limit: int, min_similarity: Optional[float]) -> Tuple[List[int], List[float]]:
+        """Ids and scores of the top-k rows by cosine similarity, best first (CPU only)"""
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vector)
+        if query_norm == 0:
+            return [], []
+        
+        # Rows are pre-normalized, so one matrix-vector product gives every cosine similarity
+        similarities = matrix @ (query_vector / query_norm)
+        
+        # Top-k with an O(N) partition, then sort just those k
+        k = min(limit, len(similarities))
+        if k < len(similarities):
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top])]
+        else:
+            top = np.argsort(-similarities)
+        if min_similarity is not None:
+            top = top[similarities[top] >= min_similarity]
+        return ids[top].tolist(), similarities[top].tolist()
+    
+    @staticmethod
+    def _hydrate_search_results(db: Session, top_ids: List[int], scores: List[float]) -> List[dict]:
+        """Load the winning rows, with their filenames, in one query and keep the ranking"""
+        rows = db.query(
+            Embedding.id, Embedding.document_id, Embedding.chunk_text,
+            Embedding.chunk_index, Document.filename
+        ).outerjoin(Document, Embedding.document_id == Document.id).filter(
+            Embedding.id.in_(top_ids)
+        ).all()
+        rows_by_id = {row.id: row for row in rows}
+        
+        results = []
+        for embedding_id, score in zip(top_ids, scores):
+            row = rows_by_id.get(embedding_id)
+            if row is None:
+                continue
+            results.append({
+                'id': row.id,
+                'document_id': row.document_id,
+                'chunk_text': row.chunk_text,
+                'chunk_index': row.chunk_index,
+                'similarity': float(score),
+                'document_filename': row.filename
+            })
+        return results
+    
+    def _cached_search_matrix(self, user_id: Optional[int]) -> Tuple[Optional[Tuple[np.ndarray, np.ndarray]], int]:
+        """The cached matrix for a user (or None) and the generation to store a rebuild under"""
+        with self._matrix_lock:
+            return self._matrix_cache.get(user_id), self._matrix_generation
+    
+    def _store_search_matrix(self, user_id: Optional[int],
+                             search_matrix: Tuple[np.ndarray, np.ndarray], generation: int) -> None:
+        """Cache a rebuilt matrix unless an invalidation happened while it was built"""
+        with self._matrix_lock:
+            if self._matrix_generation == generation:
+                self._matrix_cache[user_id] = search_matrix
+    
+    @staticmethod
+    def _load_search_rows(db: Session, user_id: Optional[int]) -> Tuple[List[int], list]:
+        """Row ids and raw embedding blobs to build a search matrix from (DB only)"""
+        # Read the column as plain bytes so rows aren't decoded one array at a time
+        query = db.query(Embedding.id, type_coerce(Embedding.embedding, LargeBinary).label("embedding"))
+        
+        # Filter by user if specified
+        if user_id:
+            query = query.join(Document).filter(Document.user_id == user_id)
+        
+        # Ensure embedding exists
+        rows = [row for row in query.all() if row.embedding is not None and len(row.embedding)]
+        return [row.id for row in rows], [row.embedding for row in rows]
+    
+    @staticmethod
+    def _build_search_matrix(ids: List[int], blobs: list) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Stack embeddings into an L2-normalized float32 matrix with matching ids (CPU only)"""
+        if not ids:
+            return None
+        
+        if all(isinstance(blob, bytes) for blob in blobs):
+            # One copy into a contiguous writable buffer, viewed as float32 rows
+            matrix = np.frombuffer(bytearray().join(blobs), dtype="<f4").reshape(len(blobs), -1)
+        else:
+            # Rows written before the switch from JSON (or already decoded values)
+            decoder = Float32Vector()
+            matrix = np.asarray([
+                decoder.process_result_value(blob, None) if isinstance(blob, (bytes, str)) else blob
+                for blob in blobs
+            ], dtype=np.float32)
+        
+        # Vectors are stored unit-length; only rows written before that (or
+        # zero vectors) need rescaling here
+        norms = np.linalg.norm(matrix, axis=1)
+        off_unit = np.abs(norms - 1.0) > UNIT_NORM_TOLERANCE
+        if off_unit.any():
+            norms[norms == 0] = 1.0
+            matrix[off_unit] /= norms[off_unit, None]
+        
+        return np.array(ids, dtype=np.int64), matrix
+    
+    def _get_search_matrix(self, db: Session,
+                           user_id: Optional[int]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Stacked, L2-normalized embedding matrix and matching row ids, cached per user"""
+        cached, generation = self._cached_search_matrix(user_id)
+        if cached is not None:
+            return cached
+        search_matrix = self._build_search_matrix(*self._load_search_rows(db, user_id))
+        if search_matrix is not None:
+            self._store_search_matrix(user_id, search_matrix, generation)
+        return search_matrix
+    
+    def invalidate_search_matrix(self, user_id: Optional[int]) -> None:
+        """Drop cached search matrices that include a user's chunks (call after commit)"""
+        with self._matrix_lock:
+            self._matrix_generation += 1
+            self._matrix_cache.pop(user_id, None)
+            self._matrix_cache.pop(None, None)
+    
     def get_document_chunks(self, db: Session, document_id: int) -> List[dict]:
         """
         Get all chunks for a specific document
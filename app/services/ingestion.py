@@ -0,0 +1,69 @@
+import os
+import logging
+
+from ..database import SessionLocal
+from ..models import Document
+from .embeddings import embedding_service
+from .pdf_processor import PDFProcessor
+from .rag import rag_service
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class IngestionService:
+    """Turns an uploaded PDF into stored chunk embeddings, outside the request cycle"""
+
+    def __init__(self):
+        self.embedding_service = embedding_service
+
+    def process_document(self, document_id: int, file_path: str) -> bool:
+        """
+        Parse, embed and store a document, then flip its status
+
+        Runs as a FastAPI background task (in the threadpool), so it opens its
+        own sync session. Embeddings and the status change commit together.
+
+        Args:
+            document_id: ID of the document row created at upload time
+            file_path: Path of the uploaded PDF
+
+        Returns:
+            True if the document is ready, False if processing failed
+        """
+        db = SessionLocal()
+        try:
+            chunks = PDFProcessor().process_pdf(file_path)
+            chunk_texts = [chunk['content'] for chunk in chunks]
+
+            embeddings = self.embedding_service.batch_generate_embeddings(chunk_texts, db=db)
+
+            stored = self.embedding_service.store_embeddings(
+                db, document_id, chunk_texts, embeddings, commit=False
+            )
+            if not stored:
+                raise RuntimeError("Failed to store document embeddings")
+
+            db.query(Document).filter(Document.id == document_id).update({"status": "ready"})
+            db.commit()
+            user_id = db.query(Document.user_id).filter(Document.id == document_id).scalar()
+            self.embedding_service.invalidate_search_matrix(user_id)
+            # Cached results for repeated queries predate the new chunks
+            rag_service.invalidate_search_cache(user_id)
+            logger.info(f"Document {document_id} processed into {len(chunk_texts)} chunks")
+            return True
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error processing document {document_id}: {str(e)}")
+            db.query(Document).filter(Document.id == document_id).update({"status": "failed"})
+            db.commit()
+            # Clean up file if processing fails
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return False
+        finally:
+            db.close()
+
+# Create global instance
+ingestion_service = IngestionService()
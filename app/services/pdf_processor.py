@@ -1,8 +1,52 @@
-import PyPDF2
+import multiprocessing
+import os
+import pypdfium2 as pdfium
 import re
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, List, Dict, Any, Tuple, Union
 from ..config import settings
 
+# Compiled once at import rather than looked up in re's cache on every call
+WHITESPACE_RE = re.compile(r'\s+')
+SPECIAL_CHARS_RE = re.compile(r'[^\w\s\.\,\!\?\;\:\-\(\)\[\]\{\}]')
+PAGE_MARKER_RE = re.compile(r'--- Page \d+ ---')
+
+SENTENCE_ENDINGS = ('.', '!', '?', '\n')
+
+# pdfium is not thread-safe, and ingestion runs in the server's threadpool, so
+# every in-process pdfium call (open, extract, close) holds this lock
+_PDFIUM_LOCK = threading.Lock()
+
+# Documents with at least this many pages are extracted by a process pool.
+# Parallelism has to come from processes for the same reason,
+# and each spawned worker imports the app and re-opens the file (~0.5 s), which
+# only pays off for long documents.
+PARALLEL_EXTRACTION_MIN_PAGES = 256
+
+def _extract_pages(pdf: pdfium.PdfDocument, start: int, stop: int) -> List[str]:
+    """Extract pages [start, stop) of an open PDF as text parts with page markers"""
+    parts = []
+    for page_num in range(start, stop):
+        page = pdf[page_num]
+        textpage = page.get_textpage()
+        page_text = textpage.get_text_range()
+        textpage.close()
+        page.close()
+        if page_text:
+            parts.append(f"\n--- Page {page_num + 1} ---\n{page_text}\n")
+    return parts
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> List[str]:
+    """Process pool worker: open the PDF and extract pages [start, stop)"""
+    # Uncontended in a pool worker; keeps the function safe if called in-process
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            return _extract_pages(pdf, start, stop)
+        finally:
+            pdf.close()
+
 class PDFProcessor:
     """Service for processing PDF files and extracting text chunks"""
     
@@ -17,27 +61,41 @@ class PDFProcessor:
         self.chunk_size = chunk_size or settings.CHUNK_SIZE
         self.chunk_overlap = chunk_overlap or settings.CHUNK_OVERLAP
     
-    def extract_text_from_pdf(self, file_path: str) -> str:
+    def extract_text_from_pdf(self, file_path: Union[str, IO[bytes]]) -> str:
         """
-        Extract text from a PDF file using PyPDF2
+        Extract text from a PDF file using pdfium (native, much faster than pure-Python parsers)
         
         Args:
-            file_path: Path to the PDF file
+            file_path: Path to the PDF file, or a binary file object (e.g. a PDF
+                read from S3) to parse without writing it to disk first
             
         Returns:
             Extracted text as a string
         """
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                
-                for page_num, page in enumerate(pdf_reader.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
-                
-                return text
+            with _PDFIUM_LOCK:
+                pdf = pdfium.PdfDocument(file_path)
+                try:
+                    page_count = len(pdf)
+                    workers = min(os.cpu_count() or 1, page_count // PARALLEL_EXTRACTION_MIN_PAGES + 1)
+                    # Pool workers re-open the document by path, so file objects stay in-process
+                    if workers < 2 or not isinstance(file_path, str):
+                        return "".join(_extract_pages(pdf, 0, page_count))
+                finally:
+                    pdf.close()
+            
+            # Contiguous page ranges, one per worker, joined back in page order.
+            # The lock is released first so other uploads can extract while this
+            # one waits; workers are spawned (not forked) so they don't inherit
+            # threadpool state such as a lock held by another ingestion thread.
+            bounds = [page_count * i // workers for i in range(workers + 1)]
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                ranges = executor.map(
+                    _extract_page_range, [file_path] * workers, bounds[:-1], bounds[1:]
+                )
+                return "".join(part for parts in ranges for part in parts)
                 
         except Exception as e:
             raise Exception(f"Error extracting text from PDF: {str(e)}")
@@ -53,13 +111,13 @@ class PDFProcessor:
             Cleaned text
         """
         # Remove extra whitespace (multiple spaces, tabs, newlines)
-        text = re.sub(r'\s+', ' ', text)
+        text = WHITESPACE_RE.sub(' ', text)
         
         # Remove special characters but keep basic punctuation
-        text = re.sub(r'[^\w\s\.\,\!\?\;\:\-\(\)\[\]\{\}]', '', text)
+        text = SPECIAL_CHARS_RE.sub('', text)
         
         # Remove page markers
-        text = re.sub(r'--- Page \d+ ---', '', text)
+        text = PAGE_MARKER_RE.sub('', text)
         
         # Strip leading/trailing whitespace
         text = text.strip()
@@ -76,8 +134,20 @@ class PDFProcessor:
         Returns:
             List of text chunks
         """
+        return [chunk for _, _, chunk in self.split_into_chunk_spans(text)]
+    
+    def split_into_chunk_spans(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        Split text into overlapping chunks, keeping each chunk's position
+        
+        Args:
+            text: Clean text to split
+            
+        Returns:
+            List of (start, end, chunk) tuples, where text[start:end] == chunk
+        """
         if len(text) <= self.chunk_size:
-            return [text]
+            return [(0, len(text), text)]
         
         chunks = []
         start = 0
@@ -89,24 +159,19 @@ class PDFProcessor:
             if end < len(text):
                 # Look for sentence endings within the last 100 characters of the chunk
                 search_start = max(start, end - 100)
-                search_text = text[search_start:end]
                 
-                # Find the last sentence ending
-                sentence_endings = ['.', '!', '?', '\n']
-                last_ending = -1
-                
-                for ending in sentence_endings:
-                    pos = search_text.rfind(ending)
-                    if pos > last_ending:
-                        last_ending = pos
+                # Find the last sentence ending, searching the text in place (no slice copy)
+                last_ending = max(text.rfind(ending, search_start, end) for ending in SENTENCE_ENDINGS)
                 
                 # If we found a sentence ending, use it as the chunk boundary
                 if last_ending != -1:
-                    end = search_start + last_ending + 1
+                    end = last_ending + 1
             
-            chunk = text[start:end].strip()
+            window = text[start:end]
+            chunk = window.strip()
             if chunk:  # Only add non-empty chunks
-                chunks.append(chunk)
+                chunk_start = start + len(window) - len(window.lstrip())
+                chunks.append((chunk_start, chunk_start + len(chunk), chunk))
             
             # Move start position for next chunk (with overlap)
             start = end - self.chunk_overlap
@@ -115,12 +180,12 @@ class PDFProcessor:
         
         return chunks
     
-    def process_pdf(self, file_path: str) -> List[Dict[str, Any]]:
+    def process_pdf(self, file_path: Union[str, IO[bytes]]) -> List[Dict[str, Any]]:
         """
         Complete PDF processing pipeline
         
         Args:
-            file_path: Path to the PDF file
+            file_path: Path to the PDF file, or a binary file object
             
         Returns:
             List of dictionaries containing chunks with metadata
@@ -131,24 +196,20 @@ class PDFProcessor:
         # Clean the text
         cleaned_text = self.clean_text(raw_text)
         
-        # Split into chunks
-        chunks = self.split_into_chunks(cleaned_text)
+        # Split into chunks; offsets point into the cleaned text (chunks overlap)
+        spans = self.split_into_chunk_spans(cleaned_text)
         
         # Create metadata for each chunk
-        processed_chunks = []
-        total_chars_so_far = 0
-        for i, chunk in enumerate(chunks):
-            chunk_data = {
+        return [
+            {
                 'chunk_index': i,
                 'content': chunk,
                 'length': len(chunk),
-                'start_char': total_chars_so_far,
-                'end_char': total_chars_so_far + len(chunk)
+                'start_char': start,
+                'end_char': end
             }
-            processed_chunks.append(chunk_data)
-            total_chars_so_far += len(chunk)
-        
-        return processed_chunks
+            for i, (start, end, chunk) in enumerate(spans)
+        ]
     
     def get_chunk_statistics(self, chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
@@ -169,8 +230,9 @@ class PDFProcessor:
                 'max_chunk_size': 0
             }
         
-        total_chars = sum(chunk['length'] for chunk in chunks)
+        # One pass over the chunk dicts; sum/min/max then run over a flat list in C
         chunk_sizes = [chunk['length'] for chunk in chunks]
+        total_chars = sum(chunk_sizes)
         
         return {
             'total_chunks': len(chunks),
@@ -1,22 +1,158 @@
+import asyncio
 import logging
-from typing import Dict, List, Optional
-from sqlalchemy.orm import Session
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+import orjson
+import tiktoken
+from cachetools import TTLCache
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..config import settings
 from ..services.embeddings import embedding_service
-from ..crud import search_similar_chunks, generate_answer, create_query_history
+from ..crud import (
+    search_similar_chunks_async, generate_answer, stream_answer, create_query_history,
+    get_query_embedding, normalize_query
+)
+
+NO_RESULTS_ANSWER = "I couldn't find any relevant information in your documents to answer this question."
+ERROR_ANSWER = "I'm sorry, but I encountered an error while processing your query. Please try again."
+
+# Query length bounds, in characters (the maximum counts surrounding whitespace)
+MAX_QUERY_LENGTH = 500
+MIN_QUERY_LENGTH = 3
+
+def _sse_event(data: Dict, event: Optional[str] = None) -> bytes:
+    """Format one server-sent event with a JSON payload"""
+    prefix = f"event: {event}\n".encode() if event else b""
+    return prefix + b"data: " + orjson.dumps(data) + b"\n\n"
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Queue sentinel: the answer stream has finished (or was stopped)
+_STREAM_END = object()
+
+def _pump_answer_stream(deltas: Iterator[str], loop: asyncio.AbstractEventLoop,
+                        queue: asyncio.Queue, stop: threading.Event) -> None:
+    """Worker thread: drive the blocking OpenAI stream and hand each delta to the event loop"""
+    def put(item) -> None:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # The event loop is already closed; nobody is listening
+            pass
+    
+    try:
+        for delta in deltas:
+            # Checked between deltas; a stalled read ends when the next chunk arrives
+            if stop.is_set():
+                break
+            put(delta)
+    except Exception as e:
+        put(e)
+    finally:
+        # Same thread that runs the generator, so it can always be closed here;
+        # closing it closes the upstream HTTP stream
+        deltas.close()
+        put(_STREAM_END)
+
+# After a failed tokenizer load (tiktoken downloads the encoding on first use),
+# context size is estimated from length until a retry after this many seconds
+TOKENIZER_RETRY_SECONDS = 300
+
+_tokenizer: Optional[tiktoken.Encoding] = None
+_tokenizer_lock = threading.Lock()
+_tokenizer_loading = False
+_tokenizer_next_attempt = 0.0
+
+def _load_tokenizer() -> Optional[tiktoken.Encoding]:
+    """Load the chat model's tokenizer (blocking; may download it); failures are retried later"""
+    global _tokenizer, _tokenizer_loading, _tokenizer_next_attempt
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(settings.OPENAI_MODEL)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _tokenizer = encoding
+        return encoding
+    except Exception as e:
+        logger.warning(
+            f"Tokenizer unavailable, estimating context tokens from length "
+            f"(retrying in {TOKENIZER_RETRY_SECONDS}s): {str(e)}"
+        )
+        _tokenizer_next_attempt = time.monotonic() + TOKENIZER_RETRY_SECONDS
+        return None
+    finally:
+        with _tokenizer_lock:
+            _tokenizer_loading = False
+
+def get_tokenizer() -> Optional[tiktoken.Encoding]:
+    """Tokenizer of the chat model if loaded; otherwise start loading it in the background"""
+    global _tokenizer_loading
+    if _tokenizer is not None:
+        return _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer_loading or time.monotonic() < _tokenizer_next_attempt:
+            return None
+        _tokenizer_loading = True
+    # Never load on the caller's thread: that is usually the event loop
+    threading.Thread(target=_load_tokenizer, name="tokenizer-load", daemon=True).start()
+    return None
+
+def count_tokens(text: str) -> int:
+    """Number of chat-model tokens in a text (a conservative estimate until the tokenizer loads)"""
+    encoding = get_tokenizer()
+    if encoding is None:
+        return len(text) // 3 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
 class RAGService:
     def __init__(self):
         self.embedding_service = embedding_service
         self.min_similarity_threshold = 0.7
-        self.max_context_length = 4000
+        # Context budget in chat-model tokens (about the old 4000-character limit)
+        self.max_context_tokens = 1000
+        self.search_limit = 5
+        # Recent retrieval results keyed by (user_id, normalized query, limit, threshold), so
+        # double-clicks and quick re-asks skip the similarity scan
+        self._search_cache = TTLCache(maxsize=1024, ttl=60)
+        self._search_cache_lock = threading.Lock()
     
-    def process_query(self, query: str, user_id: int, db: Session) -> Dict:
+    def invalidate_search_cache(self, user_id: int) -> None:
+        """Forget cached retrieval results for a user, e.g. after a document is deleted"""
+        with self._search_cache_lock:
+            for key in [k for k in self._search_cache if k[0] == user_id]:
+                self._search_cache.pop(key, None)
+    
+    async def _retrieve(self, query: str, user_id: int, db: AsyncSession) -> List[Dict]:
+        """Embed the query and find the user's most similar chunks, reusing recent results"""
+        cache_key = (user_id, normalize_query(query), self.search_limit, self.min_similarity_threshold)
+        with self._search_cache_lock:
+            similar_chunks = self._search_cache.get(cache_key)
+        if similar_chunks is not None:
+            logger.info("Using cached search results")
+            return similar_chunks
+        
+        # Query embeddings are cached per normalized query; a miss calls the API
+        # (and may wait out a rate limit), so it runs off the event loop
+        query_embedding = await asyncio.to_thread(get_query_embedding, query)
+        
+        logger.info("Searching for similar chunks...")
+        similar_chunks = await search_similar_chunks_async(
+            db,
+            query_embedding=query_embedding,
+            user_id=user_id,
+            limit=self.search_limit,
+            min_similarity=self.min_similarity_threshold
+        )
+        if similar_chunks:
+            with self._search_cache_lock:
+                self._search_cache[cache_key] = similar_chunks
+        return similar_chunks
+    
+    async def process_query(self, query: str, user_id: int, db: AsyncSession) -> Dict:
         """
         Process a user query using RAG pipeline
         
@@ -29,45 +165,31 @@ class RAGService:
             Dictionary containing answer and source references
         """
         try:
-            # Step 1: Generate query embedding
+            # Steps 1-2: Embed the query and find similar chunks from user's documents
             logger.info(f"Processing query for user {user_id}: {query[:50]}...")
-            query_embedding = self.embedding_service.generate_embedding(query)
-            
-            # Step 2: Find similar chunks from user's documents
-            logger.info("Searching for similar chunks...")
-            similar_chunks = search_similar_chunks(
-                db=db,
-                query_embedding=query_embedding,
-                user_id=user_id,
-                limit=5
-            )
+            similar_chunks = await self._retrieve(query, user_id, db)
             
-            # Check if we found any relevant chunks
-            if not similar_chunks:
-                return {
-                    "answer": "I couldn't find any relevant information in your documents to answer this question.",
-                    "sources": [],
-                    "context_used": False
-                }
-            
-            # Step 3: Create context from top chunks
+            # Step 3: Create context from top chunks; the search only returns
+            # chunks at or above the similarity threshold
             logger.info(f"Found {len(similar_chunks)} similar chunks")
             context, sources = self._build_context(similar_chunks)
             
             if not context:
                 return {
-                    "answer": "I couldn't find sufficiently relevant information in your documents to answer this question.",
+                    "answer": NO_RESULTS_ANSWER,
                     "sources": [],
-                    "context_used": False
+                    "context_used": False,
+                    "query": query
                 }
             
             # Step 4: Call OpenAI Chat API with context
             logger.info("Generating answer with OpenAI...")
-            answer = generate_answer(query, context)
+            # Blocking chat completion; run it off the event loop
+            answer = await asyncio.to_thread(generate_answer, query, context)
             
             # Step 5: Store query in history
             try:
-                create_query_history(
+                await create_query_history(
                     db=db,
                     user_id=user_id,
                     query=query,
@@ -89,58 +211,123 @@ class RAGService:
         except Exception as e:
             logger.error(f"Error processing query: {str(e)}")
             return {
-                "answer": "I'm sorry, but I encountered an error while processing your query. Please try again.",
+                "answer": ERROR_ANSWER,
                 "sources": [],
                 "context_used": False,
                 "error": str(e)
             }
     
+    async def stream_query(self, query: str, user_id: int, db: AsyncSession) -> AsyncIterator[bytes]:
+        """
+        Run the RAG pipeline and stream the answer as server-sent events
+        
+        Emits one "sources" event, then "data" events carrying answer deltas,
+        then "done" (or "error"). The full answer is stored in history at the end.
+        
+        Args:
+            query: The user's question
+            user_id: ID of the user making the query
+            db: Database session
+            
+        Yields:
+            Encoded server-sent event frames
+        """
+        try:
+            logger.info(f"Streaming query for user {user_id}: {query[:50]}...")
+            similar_chunks = await self._retrieve(query, user_id, db)
+            context, sources = self._build_context(similar_chunks)
+            
+            yield _sse_event({"query": query, "sources": sources, "context_used": bool(context)}, "sources")
+            if not context:
+                yield _sse_event({"delta": NO_RESULTS_ANSWER})
+                yield _sse_event({}, "done")
+                return
+            
+            # The OpenAI stream is blocking, so one worker thread reads all of it
+            # and feeds a queue; the stop flag ends it if the client goes away
+            loop = asyncio.get_running_loop()
+            queue: asyncio.Queue = asyncio.Queue()
+            stop = threading.Event()
+            loop.run_in_executor(
+                None, _pump_answer_stream, stream_answer(query, context), loop, queue, stop
+            )
+            parts = []
+            try:
+                while (item := await queue.get()) is not _STREAM_END:
+                    if isinstance(item, Exception):
+                        raise item
+                    parts.append(item)
+                    yield _sse_event({"delta": item})
+            finally:
+                # Also runs when the client disconnects mid-answer
+                stop.set()
+            
+            try:
+                await create_query_history(
+                    db=db,
+                    user_id=user_id,
+                    query=query,
+                    answer="".join(parts),
+                    sources_count=len(sources)
+                )
+            except Exception as e:
+                logger.warning(f"Failed to store query history: {str(e)}")
+            
+            yield _sse_event({}, "done")
+            
+        except asyncio.CancelledError:
+            # Client disconnected: there is no response left to write an error to
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            yield _sse_event({"detail": ERROR_ANSWER}, "error")
+    
     def _build_context(self, similar_chunks: List[Dict]) -> tuple[str, List[Dict]]:
         """
         Build context string and source references from similar chunks
         
         Args:
-            similar_chunks: List of similar chunks with metadata
+            similar_chunks: Similar chunks with metadata, already filtered by
+                the similarity threshold in the search
             
         Returns:
             Tuple of (context_string, source_references)
         """
         context_parts = []
         sources = []
-        current_length = 0
+        seen_document_ids = set()
+        current_tokens = 0
         
         for chunk in similar_chunks:
-            # Skip chunks with low similarity
-            if chunk.get('similarity', 0) < self.min_similarity_threshold:
-                continue
-            
             chunk_text = chunk.get('chunk_text', '').strip()
             if not chunk_text:
                 continue
             
-            # Check if adding this chunk would exceed max context length
-            if current_length + len(chunk_text) > self.max_context_length:
+            # Check if adding this chunk would exceed the context token budget
+            chunk_tokens = count_tokens(chunk_text)
+            if current_tokens + chunk_tokens > self.max_context_tokens:
                 break
             
             # Add chunk to context
             context_parts.append(chunk_text)
-            current_length += len(chunk_text)
+            current_tokens += chunk_tokens
             
             # Add source reference
             source_info = {
                 "document_id": chunk.get('document_id'),
                 "document_filename": chunk.get('document_filename'),
                 "chunk_index": chunk.get('chunk_index'),
-                "similarity": round(chunk.get('similarity', 0), 3)
+                "similarity": round(float(chunk.get('similarity', 0)), 3)
             }
             
             # Avoid duplicate sources from the same document
-            if not any(s['document_id'] == source_info['document_id'] for s in sources):
+            if source_info['document_id'] not in seen_document_ids:
+                seen_document_ids.add(source_info['document_id'])
                 sources.append(source_info)
         
         context = "\n\n".join(context_parts)
         
-        logger.info(f"Built context with {len(context_parts)} chunks, {len(context)} characters")
+        logger.info(f"Built context with {len(context_parts)} chunks, {current_tokens} tokens")
         return context, sources
     
     def validate_query(self, query: str) -> tuple[bool, Optional[str]]:
@@ -153,14 +340,15 @@ class RAGService:
         Returns:
             Tuple of (is_valid, error_message)
         """
-        if not query or not query.strip():
+        stripped = query.strip() if query else ""
+        if not stripped:
             return False, "Query cannot be empty"
         
-        if len(query) > 500:
-            return False, "Query is too long. Maximum 500 characters allowed."
+        if len(query) > MAX_QUERY_LENGTH:
+            return False, f"Query is too long. Maximum {MAX_QUERY_LENGTH} characters allowed."
         
-        if len(query.strip()) < 3:
-            return False, "Query is too short. Please provide at least 3 characters."
+        if len(stripped) < MIN_QUERY_LENGTH:
+            return False, f"Query is too short. Please provide at least {MIN_QUERY_LENGTH} characters."
         
         return True, None
 
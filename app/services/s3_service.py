@@ -1,31 +1,66 @@
 # app/services/s3_service.py
+import io
+from typing import Optional
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from app.config import settings
 import os
 
+# Built once at import: boto3.client() loads service models from disk and opens
+# its own connection pool, which is too slow to repeat per request
+S3_CLIENT_CONFIG = Config(
+    max_pool_connections=50,
+    retries={"max_attempts": 3, "mode": "adaptive"}
+)
+
+# Managed transfers: files from 8 MB up go as concurrent multipart uploads / ranged
+# downloads. max_concurrency stays well under the client's connection pool.
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
+s3_client = None
+if settings.S3_BUCKET_NAME:
+    s3_client = boto3.client(
+        's3',
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID or None,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY or None,
+        region_name=settings.AWS_REGION,
+        config=S3_CLIENT_CONFIG
+    )
+
 class S3Service:
-    def __init__(self):
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.aws_access_key_id,
-            aws_secret_access_key=settings.aws_secret_access_key,
-            region_name=settings.aws_region
-        )
-        self.bucket_name = settings.s3_bucket_name
+    def __init__(self, client=None):
+        self.s3_client = client or s3_client
+        self.bucket_name = settings.S3_BUCKET_NAME
     
     def upload_file(self, file_path: str, s3_key: str) -> str:
         """Upload file to S3 and return URL"""
         try:
-            self.s3_client.upload_file(file_path, self.bucket_name, s3_key)
-            return f"https://{self.bucket_name}.s3.{settings.aws_region}.amazonaws.com/{s3_key}"
+            self.s3_client.upload_file(file_path, self.bucket_name, s3_key, Config=S3_TRANSFER_CONFIG)
+            return f"https://{self.bucket_name}.s3.{settings.AWS_REGION}.amazonaws.com/{s3_key}"
         except Exception as e:
             raise Exception(f"Failed to upload to S3: {e}")
     
     def download_file(self, s3_key: str, local_path: str):
         """Download file from S3 to local path"""
         try:
-            self.s3_client.download_file(self.bucket_name, s3_key, local_path)
+            self.s3_client.download_file(self.bucket_name, s3_key, local_path, Config=S3_TRANSFER_CONFIG)
+        except Exception as e:
+            raise Exception(f"Failed to download from S3: {e}")
+    
+    def get_fileobj(self, s3_key: str) -> io.BytesIO:
+        """Download an object into memory, e.g. to hand a PDF straight to PDFProcessor"""
+        try:
+            buffer = io.BytesIO()
+            self.s3_client.download_fileobj(self.bucket_name, s3_key, buffer, Config=S3_TRANSFER_CONFIG)
+            buffer.seek(0)
+            return buffer
         except Exception as e:
             raise Exception(f"Failed to download from S3: {e}")
     
@@ -34,4 +69,7 @@ class S3Service:
         try:
             self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_key)
         except Exception as e:
-            raise Exception(f"Failed to delete from S3: {e}")
\ No newline at end of file
+            raise Exception(f"Failed to delete from S3: {e}")
+
+# Create global instance (None when S3 is not configured)
+s3_service: Optional[S3Service] = S3Service() if s3_client is not None else None
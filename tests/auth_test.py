@@ -9,6 +9,10 @@ import json
 
 BASE_URL = "http://localhost:8000"
 
+# One session for the whole run, so every request reuses the pooled keep-alive connection
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": "auth-test/1"})
+
 def test_register():
     """Test user registration"""
     print("🔐 Testing user registration...")
@@ -19,7 +23,7 @@ def test_register():
         "password": "testpassword123"
     }
     
-    response = requests.post(f"{BASE_URL}/auth/register", json=user_data)
+    response = SESSION.post(f"{BASE_URL}/auth/register", json=user_data)
     
     if response.status_code == 200:
         print("✅ Registration successful!")
@@ -41,7 +45,7 @@ def test_login():
         "password": "testpassword123"
     }
     
-    response = requests.post(
+    response = SESSION.post(
         f"{BASE_URL}/auth/login", 
         json=login_data,  # JSON data, not form data
         headers={"Content-Type": "application/json"}
@@ -62,7 +66,7 @@ def test_me_endpoint(token):
     print("\n👤 Testing /me endpoint...")
     
     headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(f"{BASE_URL}/auth/me", headers=headers)
+    response = SESSION.get(f"{BASE_URL}/auth/me", headers=headers)
     
     if response.status_code == 200:
         user_data = response.json()
@@ -80,14 +84,14 @@ def test_health_endpoints():
     print("\n🏥 Testing health endpoints...")
     
     # Test main health endpoint
-    response = requests.get(f"{BASE_URL}/health")
+    response = SESSION.get(f"{BASE_URL}/health")
     if response.status_code == 200:
         print("✅ Main health endpoint working")
     else:
         print(f"❌ Main health endpoint failed: {response.status_code}")
     
     # Test query health endpoint
-    response = requests.get(f"{BASE_URL}/query/health")
+    response = SESSION.get(f"{BASE_URL}/query/health")
     if response.status_code == 200:
         print("✅ Query health endpoint working")
     else:
@@ -102,7 +106,7 @@ def main():
     
     # Test if server is running
     try:
-        response = requests.get(f"{BASE_URL}/")
+        response = SESSION.get(f"{BASE_URL}/")
         if response.status_code != 200:
             print("❌ Server not responding. Make sure it's running on localhost:8000")
             return
@@ -138,4 +142,5 @@ def main():
         print("❌ Some tests failed. Check the errors above.")
 
 if __name__ == "__main__":
-    main()
+    with SESSION:
+        main()
@@ -6,6 +6,7 @@ Tests all components: Config, Database, OpenAI, and AWS S3
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -129,8 +130,8 @@ def test_upload_directory():
         print(f"❌ Upload directory test failed: {e}")
         return False
 
-def main():
-    """Run all tests"""
+def main(parallel=False):
+    """Run all tests (concurrently with parallel=True; their output may interleave)"""
     print("🧪 Running Complete RAG System Configuration Tests\n")
     
     tests = [
@@ -142,8 +143,16 @@ def main():
     ]
     
     results = {}
-    for test_name, test_func in tests:
-        results[test_name] = test_func()
+    if parallel:
+        # The checks are independent and mostly wait on the network (DB, OpenAI, S3),
+        # so threads finish in roughly the time of the slowest one
+        with ThreadPoolExecutor(max_workers=len(tests)) as executor:
+            futures = [(test_name, executor.submit(test_func)) for test_name, test_func in tests]
+        for test_name, future in futures:
+            results[test_name] = future.result()
+    else:
+        for test_name, test_func in tests:
+            results[test_name] = test_func()
     
     # Summary
     print("\n" + "="*50)
@@ -169,4 +178,4 @@ def main():
         return 1
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(main(parallel="--parallel" in sys.argv[1:]))
@@ -0,0 +1,58 @@
+import asyncio
+import hashlib
+import hmac
+import time
+import jwt
+import pytest
+
+from app import auth
+from app.auth import get_password_hash, verify_password
+
+TEST_PASSWORD = "my_secure_password_123"
+
+
+@pytest.fixture(scope="session")
+def hashed_pw():
+    """Hash the canonical test password once; bcrypt is slow by design"""
+    return asyncio.run(get_password_hash(TEST_PASSWORD))
+
+
+def test_hash_format(hashed_pw):
+    """Test that hashes use the standard 60-character bcrypt format"""
+    assert hashed_pw.startswith("$2b$")
+    assert len(hashed_pw) == 60
+    assert TEST_PASSWORD not in hashed_pw
+
+
+def test_verify_correct(hashed_pw):
+    """Test that the original password verifies"""
+    assert asyncio.run(verify_password(TEST_PASSWORD, hashed_pw)) is True
+
+
+def test_verify_wrong(hashed_pw):
+    """Test that a different password is rejected"""
+    assert asyncio.run(verify_password("wrong_password", hashed_pw)) is False
+
+
+def test_empty_password():
+    """Test that an empty password still hashes and only matches itself"""
+    hashed = asyncio.run(get_password_hash(""))
+    assert asyncio.run(verify_password("", hashed)) is True
+    assert asyncio.run(verify_password(TEST_PASSWORD, hashed)) is False
+
+
+@pytest.mark.parametrize("algorithm", ["HS256", "HS384", "HS512"])
+@pytest.mark.parametrize("subject", ["user@example.com", "usér@exämple.com"])
+def test_encode_claims_matches_pyjwt(monkeypatch, algorithm, subject):
+    """Test that hand-signed tokens are byte-identical to jwt.encode"""
+    digest = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}[algorithm]
+    monkeypatch.setattr(auth, "_ALGORITHM", algorithm)
+    monkeypatch.setattr(auth, "_JWT_HEADER_SEGMENT", auth._b64url(f'{{"alg":"{algorithm}","typ":"JWT"}}'.encode()))
+    monkeypatch.setattr(auth, "_hmac_template", hmac.new(auth._SIGNING_KEY, digestmod=digest))
+    claims = {"sub": subject, "exp": int(time.time()) + 60}
+    
+    assert auth._encode_claims(claims) == jwt.encode(claims, auth._SIGNING_KEY, algorithm=algorithm)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -2,15 +2,18 @@
 """
 Test script for authentication API endpoints
 This script demonstrates the usage of the auth API endpoints
+
+Run it directly against a live server (python tests/test_auth_api.py); the
+check_* probes share one client and are not collected by pytest.
 """
 
-import requests
-import json
+import asyncio
+import httpx
 
 # Base URL for the API
 BASE_URL = "http://localhost:8000"
 
-def test_register():
+async def check_register(client):
     """Test user registration"""
     print("🔐 Testing user registration...")
     
@@ -21,7 +24,7 @@ def test_register():
     }
     
     try:
-        response = requests.post(f"{BASE_URL}/auth/register", json=register_data)
+        response = await client.post("/auth/register", json=register_data)
         print(f"Status Code: {response.status_code}")
         
         if response.status_code == 200:
@@ -35,11 +38,11 @@ def test_register():
             print(f"❌ Registration failed: {response.text}")
             return None
             
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         print("❌ Could not connect to the API. Make sure the server is running.")
         return None
 
-def test_login(username, password):
+async def check_login(client, username, password):
     """Test user login"""
     print(f"\n🔑 Testing user login for {username}...")
     
@@ -49,7 +52,7 @@ def test_login(username, password):
     }
     
     try:
-        response = requests.post(f"{BASE_URL}/auth/login", json=login_data)
+        response = await client.post("/auth/login", json=login_data)
         print(f"Status Code: {response.status_code}")
         
         if response.status_code == 200:
@@ -63,11 +66,11 @@ def test_login(username, password):
             print(f"❌ Login failed: {response.text}")
             return None
             
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         print("❌ Could not connect to the API. Make sure the server is running.")
         return None
 
-def test_get_me(token):
+async def check_get_me(client, token):
     """Test getting current user info"""
     print(f"\n👤 Testing get current user info...")
     
@@ -76,7 +79,7 @@ def test_get_me(token):
     }
     
     try:
-        response = requests.get(f"{BASE_URL}/auth/me", headers=headers)
+        response = await client.get("/auth/me", headers=headers)
         print(f"Status Code: {response.status_code}")
         
         if response.status_code == 200:
@@ -91,11 +94,11 @@ def test_get_me(token):
             print(f"❌ Failed to get user info: {response.text}")
             return False
             
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         print("❌ Could not connect to the API. Make sure the server is running.")
         return False
 
-def test_invalid_token():
+async def check_invalid_token(client):
     """Test with invalid token"""
     print(f"\n🚫 Testing with invalid token...")
     
@@ -104,7 +107,7 @@ def test_invalid_token():
     }
     
     try:
-        response = requests.get(f"{BASE_URL}/auth/me", headers=headers)
+        response = await client.get("/auth/me", headers=headers)
         print(f"Status Code: {response.status_code}")
         
         if response.status_code == 401:
@@ -114,29 +117,33 @@ def test_invalid_token():
             print(f"❌ Expected 401, got {response.status_code}")
             return False
             
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         print("❌ Could not connect to the API. Make sure the server is running.")
         return False
 
-if __name__ == "__main__":
+async def main():
     print("🧪 Testing Authentication API Endpoints")
     print("=" * 50)
     
-    # Test registration
-    user_data = test_register()
-    
-    if user_data:
-        # Test login
-        token = test_login("testuser", "testpassword123")
+    # One pooled client: every request reuses the same keep-alive connections
+    async with httpx.AsyncClient(
+        base_url=BASE_URL, limits=httpx.Limits(max_keepalive_connections=20)
+    ) as client:
+        # Test registration
+        user_data = await check_register(client)
         
-        if token:
-            # Test get current user
-            test_get_me(token)
+        if user_data:
+            # Test login
+            token = await check_login(client, "testuser", "testpassword123")
             
-            # Test invalid token
-            test_invalid_token()
+            if token:
+                # Current user and invalid token checks are independent; run them together
+                await asyncio.gather(check_get_me(client, token), check_invalid_token(client))
     
     print("\n" + "=" * 50)
     print("🎉 Auth API testing completed!")
     print("\nTo run the server:")
-    print("uvicorn app.main:app --reload") 
\ No newline at end of file
+    print("uvicorn app.main:app --reload")
+
+if __name__ == "__main__":
+    asyncio.run(main())
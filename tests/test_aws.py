@@ -1,33 +1,49 @@
 import boto3
+import hashlib
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
-from botocore.exceptions import ClientError, NoCredentialsError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
 
+REQUIRED_AWS_VARIABLES = frozenset({
+    'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_REGION', 'S3_BUCKET_NAME'
+})
+
+# Objects written by the upload/download round trip (at most 1000, one delete_objects call)
+TEST_OBJECT_COUNT = 8
+
+@lru_cache(maxsize=1)
+def _get_s3():
+    """One S3 client for every check (client construction loads botocore's service models)"""
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        region_name=os.getenv('AWS_REGION'),
+        config=Config(max_pool_connections=50, retries={"max_attempts": 3, "mode": "adaptive"})
+    )
+
 def test_aws_credentials():
     """Test if AWS credentials are properly configured"""
     print("🔑 Testing AWS Credentials...")
     
-    # Check if credentials exist
-    access_key = os.getenv('AWS_ACCESS_KEY_ID')
-    secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-    region = os.getenv('AWS_REGION')
-    bucket_name = os.getenv('S3_BUCKET_NAME')
+    # Check if credentials exist (set and non-empty)
+    env = os.environ
+    missing = sorted(name for name in REQUIRED_AWS_VARIABLES if not env.get(name))
     
-    if not all([access_key, secret_key, region, bucket_name]):
-        print("❌ Missing AWS environment variables")
-        print(f"Access Key: {'✓' if access_key else '❌'}")
-        print(f"Secret Key: {'✓' if secret_key else '❌'}")
-        print(f"Region: {'✓' if region else '❌'}")
-        print(f"Bucket Name: {'✓' if bucket_name else '❌'}")
+    if missing:
+        print(f"❌ Missing AWS environment variables: {', '.join(missing)}")
         return False
     
-    print(f"Access Key: {access_key[:8]}...")
-    print(f"Region: {region}")
-    print(f"Bucket: {bucket_name}")
+    print(f"Access Key: {env['AWS_ACCESS_KEY_ID'][:8]}...")
+    print(f"Region: {env['AWS_REGION']}")
+    print(f"Bucket: {env['S3_BUCKET_NAME']}")
     return True
 
 def test_s3_connection():
@@ -36,12 +52,7 @@ def test_s3_connection():
     
     try:
         # Create S3 client
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.getenv('AWS_REGION')
-        )
+        s3_client = _get_s3()
         
         # Test credentials by listing buckets
         response = s3_client.list_buckets()
@@ -88,51 +99,73 @@ def test_bucket_access(s3_client):
             print(f"❌ Error accessing bucket: {e}")
         return False
 
-def test_upload_download():
+def _download_digest(s3_client, bucket_name, key):
+    """SHA-256 of an object, hashed chunk by chunk instead of reading it into memory"""
+    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    digest = hashlib.sha256()
+    for chunk in response['Body'].iter_chunks(chunk_size=64 * 1024):
+        digest.update(chunk)
+    return digest.digest()
+
+def test_upload_download(object_count=TEST_OBJECT_COUNT):
     """Test upload and download functionality"""
     print("\n📤 Testing Upload/Download...")
     
     bucket_name = os.getenv('S3_BUCKET_NAME')
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.getenv('AWS_REGION')
-    )
+    s3_client = _get_s3()
+    uploaded_keys = []
     
     try:
-        # Create a temporary test file
+        # Create temporary test files
         test_content = "This is a test file for RAG system S3 configuration."
-        test_key = "test-files/rag-system-test.txt"
+        expected_digest = hashlib.sha256(test_content.encode('utf-8')).digest()
+        test_keys = [f"test-files/rag-system-test-{i}.txt" for i in range(object_count)]
         
-        # Upload test file
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=test_key,
-            Body=test_content,
-            ContentType='text/plain'
-        )
-        print("✅ Successfully uploaded test file")
+        def upload(key):
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=key,
+                Body=test_content,
+                ContentType='text/plain'
+            )
+            # Recorded only once the object exists (list.append is thread-safe)
+            uploaded_keys.append(key)
         
-        # Download test file
-        response = s3_client.get_object(Bucket=bucket_name, Key=test_key)
-        downloaded_content = response['Body'].read().decode('utf-8')
+        # S3 calls are network-bound, so threads overlap their round trips
+        with ThreadPoolExecutor(max_workers=min(object_count, 16)) as executor:
+            # Upload test files
+            list(executor.map(upload, test_keys))
+            print(f"✅ Successfully uploaded {object_count} test file(s)")
+            
+            # Download test files
+            digests = list(executor.map(
+                lambda key: _download_digest(s3_client, bucket_name, key), test_keys
+            ))
         
-        if downloaded_content == test_content:
-            print("✅ Successfully downloaded and verified test file")
+        if all(digest == expected_digest for digest in digests):
+            print(f"✅ Successfully downloaded and verified {object_count} test file(s)")
         else:
             print("❌ Downloaded content doesn't match uploaded content")
             return False
         
-        # Clean up - delete test file
-        s3_client.delete_object(Bucket=bucket_name, Key=test_key)
-        print("✅ Successfully deleted test file")
-        
         return True
         
     except Exception as e:
         print(f"❌ Upload/download test failed: {e}")
         return False
+    
+    finally:
+        # Clean up - delete every uploaded test file in one request
+        if uploaded_keys:
+            try:
+                s3_client.delete_objects(
+                    Bucket=bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in uploaded_keys]}
+                )
+                print("✅ Successfully deleted test files")
+            except (ClientError, BotoCoreError) as e:
+                # Never let cleanup replace the test's own result
+                print(f"⚠️  Could not delete test files: {e}")
 
 def show_bucket_info():
     """Show useful information about the bucket"""
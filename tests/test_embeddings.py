@@ -1,6 +1,7 @@
 import pytest
 import numpy as np
 from unittest.mock import Mock, patch, MagicMock
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from openai import RateLimitError
 
@@ -9,6 +10,23 @@ from app.models import Document, Embedding, User
 from app.database import get_db
 
 
+@pytest.fixture
+def mem_db():
+    """Real ORM session on a private in-memory SQLite database"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.models import Base
+    
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        yield db
+    finally:
+        db.close()
+        engine.dispose()
+
+
 class TestEmbeddingService:
     """Test suite for Task 8: Embedding Service"""
     
@@ -20,9 +38,12 @@ class TestEmbeddingService:
     def test_service_initialization(self):
         """Test that embedding service initializes correctly"""
         assert self.service.model == "text-embedding-ada-002"
-        assert self.service.batch_size == 100
+        assert self.service.batch_size == 2048
         assert self.service.max_retries == 3
-        assert self.service.client is not None
+        # No per-instance client: the shared one is created on first use
+        assert self.service.client is None
+        with patch('app.services.embeddings.get_openai_client') as mock_get_client:
+            assert self.service._get_client() is mock_get_client.return_value
     
     @patch('app.services.embeddings.OpenAI')
     def test_generate_embedding_success(self, mock_openai):
@@ -76,6 +97,23 @@ class TestEmbeddingService:
         assert mock_client.embeddings.create.call_count == 3
         assert mock_sleep.call_count == 2  # Two retries
     
+    @patch('time.sleep')
+    def test_generate_embedding_honors_retry_after(self, mock_sleep):
+        """Test that a rate-limit retry waits for the server's Retry-After header"""
+        response = Mock(status_code=429, headers={"retry-after": "1"})
+        mock_client = Mock()
+        mock_client.embeddings.create.side_effect = [
+            RateLimitError("Rate limit", response=response, body=None),
+            Mock(data=[Mock(embedding=[0.1, 0.2, 0.3])])
+        ]
+        self.service.client = mock_client
+        
+        result = self.service.generate_embedding("test text")
+        
+        assert result == [0.1, 0.2, 0.3]
+        mock_sleep.assert_called_once()
+        assert mock_sleep.call_args[0][0] == pytest.approx(1, abs=0.1)
+    
     @patch('app.services.embeddings.OpenAI')
     def test_batch_generate_embeddings_success(self, mock_openai):
         """Test successful batch embedding generation"""
@@ -113,14 +151,11 @@ class TestEmbeddingService:
         """Test batch processing with batches larger than batch_size"""
         mock_client = Mock()
         
-        # Mock responses for two batches
-        mock_response1 = Mock()
-        mock_response1.data = [Mock(embedding=[i, i+1, i+2]) for i in range(100)]
-        
-        mock_response2 = Mock()
-        mock_response2.data = [Mock(embedding=[i, i+1, i+2]) for i in range(100, 150)]
+        # Batches may run concurrently, so answer each call from its own input
+        def create(input, model):
+            return Mock(data=[Mock(embedding=[int(text[4:])] * 3) for text in input])
         
-        mock_client.embeddings.create.side_effect = [mock_response1, mock_response2]
+        mock_client.embeddings.create.side_effect = create
         mock_openai.return_value = mock_client
         
         service = EmbeddingService()
@@ -131,8 +166,62 @@ class TestEmbeddingService:
         result = service.batch_generate_embeddings(texts)
         
         assert len(result) == 150
+        assert result == [[i, i, i] for i in range(150)]  # input order is preserved
         assert mock_client.embeddings.create.call_count == 2
-    
+
+    def test_batch_dedup(self):
+        """Test that repeated texts are sent to the API once and scattered back in order"""
+        mock_client = Mock()
+        mock_client.embeddings.create.side_effect = lambda input, model: Mock(
+            data=[Mock(embedding=[float(ord(text)), 1.0]) for text in input]
+        )
+        self.service.client = mock_client
+        
+        result = self.service.batch_generate_embeddings(["a", "b", "a", "a", "b"])
+        
+        mock_client.embeddings.create.assert_called_once()
+        assert mock_client.embeddings.create.call_args.kwargs["input"] == ["a", "b"]
+        assert result == [[97.0, 1.0], [98.0, 1.0], [97.0, 1.0], [97.0, 1.0], [98.0, 1.0]]
+
+    def test_batch_token_packing(self):
+        """Test that batches are filled up to the token budget rather than a fixed item count"""
+        texts = [("word " * (50 * (i % 7 + 1))).strip() for i in range(500)]
+        batches = self.service._pack_batches(texts)
+        
+        assert [text for batch in batches for text in batch] == texts  # order is preserved
+        assert len(batches) < len(texts) // 100  # fewer calls than fixed 100-item batches
+        for batch in batches:
+            assert len(batch) <= self.service.batch_size
+            assert sum(map(self.service._estimate_tokens, batch)) <= self.service.max_batch_tokens
+        
+        # A batch is only closed when the next text would overflow the budget
+        self.service.max_batch_tokens = 1000
+        batches = self.service._pack_batches(texts)
+        for batch, following in zip(batches, batches[1:]):
+            tokens = sum(map(self.service._estimate_tokens, batch))
+            assert tokens + self.service._estimate_tokens(following[0]) > 1000
+
+    def test_batch_generate_embeddings_uses_cache(self, mem_db):
+        """Test that cached texts skip the API and repeated texts are embedded once"""
+        db = mem_db
+        mock_client = Mock()
+        mock_client.embeddings.create.side_effect = lambda input, model: Mock(
+            data=[Mock(embedding=[float(len(text)), 1.0]) for text in input]
+        )
+        service = EmbeddingService()
+        service.client = mock_client
+
+        first = service.batch_generate_embeddings(["a", "bb", "a"], db=db)
+        mock_client.embeddings.create.assert_called_once_with(
+            input=["a", "bb"], model="text-embedding-ada-002"
+        )
+        db.commit()
+
+        second = service.batch_generate_embeddings(["bb", "ccc"], db=db)
+        assert mock_client.embeddings.create.call_args.kwargs["input"] == ["ccc"]
+        assert first == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+        assert second == [[2.0, 1.0], [3.0, 1.0]]
+
     def test_store_embeddings_success(self):
         """Test successful embedding storage"""
         # Mock document
@@ -149,9 +238,26 @@ class TestEmbeddingService:
         result = self.service.store_embeddings(self.mock_db, 1, chunks, embeddings)
         
         assert result is True
-        assert self.mock_db.add.call_count == 3
+        # One executemany INSERT carrying all rows, not one ORM add per chunk
+        self.mock_db.add.assert_not_called()
+        self.mock_db.execute.assert_called_once()
+        rows = self.mock_db.execute.call_args[0][1]
+        assert [row["chunk_index"] for row in rows] == [0, 1, 2]
+        assert [row["chunk_text"] for row in rows] == chunks
+        # Vectors are stored unit-length so search is a plain dot product
+        assert np.allclose([np.linalg.norm(row["embedding"]) for row in rows], 1.0)
         self.mock_db.commit.assert_called_once()
     
+    def test_store_embeddings_without_commit(self):
+        """Test that commit=False leaves the transaction to the caller"""
+        self.mock_db.query.return_value.filter.return_value.first.return_value = Mock()
+        
+        result = self.service.store_embeddings(self.mock_db, 1, ["chunk"], [[0.1, 0.2]], commit=False)
+        
+        assert result is True
+        self.mock_db.execute.assert_called_once()
+        self.mock_db.commit.assert_not_called()
+    
     def test_store_embeddings_document_not_found(self):
         """Test storing embeddings when document doesn't exist"""
         self.mock_db.query.return_value.filter.return_value.first.return_value = None
@@ -193,8 +299,14 @@ class TestEmbeddingService:
         mock_embedding2.embedding = [0.0, 1.0, 0.0]
         mock_embedding2.document = Mock()
         mock_embedding2.document.filename = "test.pdf"
+        mock_embedding1.filename = "test.pdf"
+        mock_embedding2.filename = "test.pdf"
         
+        # Vectors are scanned first, then only the top rows are hydrated (in any order)
         self.mock_db.query.return_value.all.return_value = [mock_embedding1, mock_embedding2]
+        self.mock_db.query.return_value.outerjoin.return_value.filter.return_value.all.return_value = [
+            mock_embedding2, mock_embedding1
+        ]
         
         query_embedding = [0.9, 0.1, 0.0]  # More similar to first embedding
         
@@ -205,16 +317,118 @@ class TestEmbeddingService:
         assert result[0]['chunk_text'] == "chunk1"
         assert result[0]['document_filename'] == "test.pdf"
     
-    def test_search_similar_chunks_with_user_filter(self):
-        """Test similarity search filtered by user"""
-        mock_query = Mock()
-        mock_query.join.return_value.filter.return_value.all.return_value = []
-        self.mock_db.query.return_value = mock_query
+    def test_search_similar_chunks_top_k_order(self):
+        """Test that only the k most similar chunks are returned, best first"""
+        vectors = [[1.0, 0.0], [0.0, 1.0], [0.8, 0.6], [0.6, 0.8], [-1.0, 0.0]]
+        rows = [
+            Mock(id=i, document_id=1, chunk_text=f"chunk{i}", chunk_index=i,
+                 embedding=vector, filename="test.pdf")
+            for i, vector in enumerate(vectors)
+        ]
+        self.mock_db.query.return_value.all.return_value = rows
+        self.mock_db.query.return_value.outerjoin.return_value.filter.return_value.all.return_value = rows
         
-        result = self.service.search_similar_chunks(self.mock_db, [0.1, 0.2], user_id=1)
+        result = self.service.search_similar_chunks(self.mock_db, [1.0, 0.0], limit=3)
         
-        assert result == []
-        mock_query.join.assert_called_once()
+        assert [chunk['id'] for chunk in result] == [0, 2, 3]
+        assert result[0]['similarity'] == pytest.approx(1.0)
+
+    def test_search_similar_chunks_min_similarity(self):
+        """Test that chunks below the similarity floor are dropped by the search"""
+        vectors = [[1.0, 0.0], [0.0, 1.0], [0.8, 0.6]]
+        rows = [
+            Mock(id=i, document_id=1, chunk_text=f"chunk{i}", chunk_index=i,
+                 embedding=vector, filename="test.pdf")
+            for i, vector in enumerate(vectors)
+        ]
+        self.mock_db.query.return_value.all.return_value = rows
+        self.mock_db.query.return_value.outerjoin.return_value.filter.return_value.all.return_value = rows
+
+        result = self.service.search_similar_chunks(
+            self.mock_db, [1.0, 0.0], limit=3, min_similarity=0.7
+        )
+
+        assert [chunk['id'] for chunk in result] == [0, 2]
+
+    def test_search_matrix_cached_until_invalidated(self):
+        """Test that the stacked embedding matrix is reused until invalidated"""
+        rows = [Mock(id=1, embedding=[3.0, 4.0]), Mock(id=2, embedding=[0.0, 2.0])]
+        self.mock_db.query.return_value.all.return_value = rows
+        
+        ids, matrix = self.service._get_search_matrix(self.mock_db, None)
+        assert ids.tolist() == [1, 2]
+        assert np.allclose(np.linalg.norm(matrix, axis=1), 1.0)
+        
+        self.service._get_search_matrix(self.mock_db, None)
+        assert self.mock_db.query.return_value.all.call_count == 1
+        
+        self.service.invalidate_search_matrix(1)
+        self.service._get_search_matrix(self.mock_db, None)
+        assert self.mock_db.query.return_value.all.call_count == 2
+    
+    def test_search_similar_chunks_with_user_filter(self, mem_db):
+        """Test similarity search filtered by user"""
+        for user_id, filename in [(1, "mine.pdf"), (2, "theirs.pdf")]:
+            mem_db.add(User(id=user_id, email=f"user{user_id}@example.com", hashed_password="hashed"))
+            mem_db.add(Document(id=user_id, user_id=user_id, filename=filename))
+        mem_db.commit()
+        self.service.store_embeddings(mem_db, 1, ["mine"], [[1.0, 0.0]])
+        self.service.store_embeddings(mem_db, 2, ["theirs"], [[1.0, 0.0]])
+        
+        result = self.service.search_similar_chunks(mem_db, [1.0, 0.0], user_id=1)
+        
+        assert [chunk["chunk_text"] for chunk in result] == ["mine"]
+        assert result[0]["document_filename"] == "mine.pdf"
+        assert self.service.search_similar_chunks(mem_db, [1.0, 0.0], user_id=3) == []
+    
+    def test_search_similar_chunks_async_matches_sync(self):
+        """Test that the async search gives the sync results with the numeric work off the loop"""
+        import asyncio
+        import threading
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from sqlalchemy.pool import StaticPool
+        from app.models import Base
+        
+        rng = np.random.default_rng(1)
+        vectors = rng.normal(size=(50, 8))
+        query = rng.normal(size=8).tolist()
+        worker_threads = set()
+        build = EmbeddingService._build_search_matrix
+        
+        def recording_build(ids, blobs):
+            worker_threads.add(threading.get_ident())
+            return build(ids, blobs)
+        
+        async def main():
+            engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            async with AsyncSession(engine) as db:
+                def seed(session):
+                    session.add(User(id=1, email="user1@example.com", hashed_password="hashed"))
+                    session.add(Document(id=1, user_id=1, filename="test.pdf"))
+                    session.commit()
+                    self.service.store_embeddings(
+                        session, 1, [f"chunk{i}" for i in range(50)], vectors.tolist()
+                    )
+                await db.run_sync(seed)
+                
+                with patch.object(EmbeddingService, "_build_search_matrix", staticmethod(recording_build)):
+                    result = await self.service.search_similar_chunks_async(
+                        db, query, user_id=1, limit=5, min_similarity=0.0
+                    )
+                expected = await db.run_sync(
+                    lambda session: EmbeddingService().search_similar_chunks(
+                        session, query, user_id=1, limit=5, min_similarity=0.0
+                    )
+                )
+            await engine.dispose()
+            return result, expected, threading.get_ident()
+        
+        result, expected, loop_thread = asyncio.run(main())
+        
+        assert result and result == expected
+        assert worker_threads and loop_thread not in worker_threads
     
     def test_search_similar_chunks_empty_database(self):
         """Test similarity search with no embeddings in database"""
@@ -269,13 +483,36 @@ class TestEmbeddingService:
         vec2 = np.array([1.0, 0.0, 0.0])  # Identical
         vec3 = np.array([0.0, 1.0, 0.0])  # Orthogonal
         
-        # Calculate similarities manually
-        sim_identical = np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-        sim_orthogonal = np.dot(vec1, vec3) / (np.linalg.norm(vec1) * np.linalg.norm(vec3))
+        # Calculate similarities the way search does: one matrix-vector product
+        matrix = np.stack([vec2, vec3])
+        sims = (matrix @ vec1) / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(vec1))
         
-        assert abs(sim_identical - 1.0) < 1e-10  # Should be 1.0
-        assert abs(sim_orthogonal - 0.0) < 1e-10  # Should be 0.0
-    
+        assert np.allclose(sims, [1.0, 0.0], atol=1e-10)  # identical, orthogonal
+
+    def test_search_similarities_match_cosine(self):
+        """Test that the vectorized search scores equal per-pair cosine similarity"""
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(20, 8)) * rng.uniform(0.5, 3.0, size=(20, 1))  # not unit length
+        query = rng.normal(size=8)
+        rows = [
+            Mock(id=i, document_id=1, chunk_text=f"chunk{i}", chunk_index=i,
+                 embedding=vector.tolist(), filename="test.pdf")
+            for i, vector in enumerate(vectors)
+        ]
+        self.mock_db.query.return_value.all.return_value = rows
+        self.mock_db.query.return_value.outerjoin.return_value.filter.return_value.all.return_value = rows
+
+        result = self.service.search_similar_chunks(self.mock_db, query.tolist(), limit=5)
+
+        expected = [
+            np.dot(vector, query) / (np.linalg.norm(vector) * np.linalg.norm(query))
+            for vector in vectors
+        ]
+        top = np.argsort(expected)[::-1][:5]
+        assert [chunk['id'] for chunk in result] == top.tolist()
+        for chunk in result:
+            assert chunk['similarity'] == pytest.approx(expected[chunk['id']], abs=1e-5)
+
     def test_global_service_instance(self):
         """Test that global embedding service instance exists"""
         assert embedding_service is not None
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from app.services import rag
+from app.services.rag import RAGService
+
+CHUNKS = [{
+    "id": 1, "document_id": 1, "chunk_text": "Paris is the capital of France.",
+    "chunk_index": 0, "similarity": 0.9, "document_filename": "france.pdf"
+}]
+
+
+def test_stream_query_cancelled_midway_closes_upstream():
+    """Test that a client disconnect stops the OpenAI stream and is not reported as an error"""
+    upstream_closed = threading.Event()
+
+    def fake_stream_answer(query, context):
+        try:
+            for i in range(1000):
+                time.sleep(0.01)
+                yield f"delta{i} "
+        finally:
+            upstream_closed.set()
+
+    async def main():
+        service = RAGService()
+        service._retrieve = AsyncMock(return_value=CHUNKS)
+        frames = []
+        first_delta = asyncio.Event()
+
+        async def consume():
+            async for frame in service.stream_query("capital of France?", user_id=1, db=None):
+                frames.append(frame)
+                if b"delta" in frame:
+                    first_delta.set()
+
+        with patch("app.services.rag.stream_answer", fake_stream_answer), \
+                patch("app.services.rag.create_query_history", AsyncMock()) as history:
+            task = asyncio.create_task(consume())
+            await first_delta.wait()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            closed = await asyncio.to_thread(upstream_closed.wait, 2)
+        return frames, closed, history
+
+    frames, closed, history = asyncio.run(main())
+
+    assert closed  # the worker thread stopped and closed the generator
+    assert not any(b"event: error" in frame for frame in frames)
+    assert not any(b"event: done" in frame for frame in frames)
+    history.assert_not_called()
+
+
+def test_stream_query_streams_all_deltas():
+    """Test that a complete stream yields sources, every delta, then done"""
+    async def main():
+        service = RAGService()
+        service._retrieve = AsyncMock(return_value=CHUNKS)
+        with patch("app.services.rag.stream_answer", lambda query, context: (d for d in ["Par", "is"])), \
+                patch("app.services.rag.create_query_history", AsyncMock()) as history:
+            frames = [frame async for frame in service.stream_query("capital?", user_id=1, db=None)]
+        return frames, history
+
+    frames, history = asyncio.run(main())
+
+    assert frames[0].startswith(b"event: sources")
+    assert frames[1:3] == [b'data: {"delta":"Par"}\n\n', b'data: {"delta":"is"}\n\n']
+    assert frames[-1] == b"event: done\ndata: {}\n\n"
+    assert history.call_args.kwargs["answer"] == "Paris"
+
+
+def test_process_query_below_threshold_returns_no_results():
+    """Test that a query with no chunks above the threshold skips the LLM"""
+    async def main():
+        service = RAGService()
+        service._retrieve = AsyncMock(return_value=[])  # the search applies min_similarity
+        with patch("app.services.rag.generate_answer") as generate:
+            result = await service.process_query("capital of France?", user_id=1, db=None)
+        return result, generate
+
+    result, generate = asyncio.run(main())
+
+    assert result["answer"] == rag.NO_RESULTS_ANSWER
+    assert result["context_used"] is False
+    generate.assert_not_called()
+
+
+@pytest.fixture
+def unloaded_tokenizer(monkeypatch):
+    """Reset the lazily loaded tokenizer state for one test"""
+    monkeypatch.setattr(rag, "_tokenizer", None)
+    monkeypatch.setattr(rag, "_tokenizer_loading", False)
+    monkeypatch.setattr(rag, "_tokenizer_next_attempt", 0.0)
+
+
+def test_get_tokenizer_never_blocks(unloaded_tokenizer):
+    """Test that a slow tokenizer download happens off the caller's thread"""
+    release = threading.Event()
+    encoding = object()
+
+    def slow_encoding_for_model(model):
+        release.wait(5)
+        return encoding
+
+    with patch("app.services.rag.tiktoken.encoding_for_model", slow_encoding_for_model):
+        started = time.monotonic()
+        assert rag.get_tokenizer() is None
+        assert rag.count_tokens("abcdef") == 3  # length estimate meanwhile
+        assert time.monotonic() - started < 1
+        release.set()
+        for _ in range(100):
+            if rag.get_tokenizer() is encoding:
+                break
+            time.sleep(0.01)
+    assert rag.get_tokenizer() is encoding
+
+
+def test_failed_tokenizer_load_is_retried(unloaded_tokenizer):
+    """Test that a failed load is not cached forever but retried after the backoff"""
+    encoding = object()
+    with patch("app.services.rag.tiktoken.encoding_for_model",
+               side_effect=[ConnectionError("offline"), encoding]):
+        assert rag._load_tokenizer() is None
+        assert rag.get_tokenizer() is None  # within the backoff: no new attempt
+        assert rag._tokenizer_loading is False
+        
+        rag._tokenizer_next_attempt = 0.0  # backoff elapsed
+        assert rag._load_tokenizer() is encoding
+    assert rag.get_tokenizer() is encoding
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])